@@ -7,7 +7,7 @@ from jose import JWTError, jwt
 from passlib.context import CryptContext
 from sqlalchemy.orm import Session
 
-from app.database import get_db
+from app.database import get_read_db, route_reads_for_user
 from app.models import User
 import os
 from dotenv import load_dotenv
@@ -75,7 +75,7 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     return encoded_jwt
 
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_read_db)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="无效的认证凭据",
@@ -90,8 +90,16 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = De
     except JWTError:
         raise credentials_exception
     user = get_user(db, username=token_data.username)
+    if user is None and not db.info.get("use_primary"):
+        # 刚注册的用户可能还未同步到副本
+        db.info["use_primary"] = True
+        user = get_user(db, username=token_data.username)
     if user is None:
         raise credentials_exception
+    # 同一请求中的只读会话会被复用，用户刚写入过时改查主库
+    route_reads_for_user(db, user.id)
+    # 先归还连接，路由在等待上游回答或写缓冲时不占用连接池；会话稍后查询时会重新取连接
+    db.close()
     return user
 
 
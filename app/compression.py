@@ -0,0 +1,185 @@
+"""
+消息内容的透明压缩
+
+超过阈值的消息在写入时压缩，以带格式标记的文本存入原有的 Text 列，读取时自动解压:
+    \\x01zs:<base64>  zstd 压缩(安装了 zstandard 时使用)
+    \\x01zl:<base64>  zlib 压缩
+    \\x01r:<原文>     以标记开头的原文，避免被误认为压缩数据
+其余内容按原文存储，因此已有数据无需迁移即可读取。
+"""
+import base64
+import logging
+import os
+import threading
+import time
+import zlib
+
+from sqlalchemy import Text, bindparam, type_coerce, update
+from sqlalchemy.types import TypeDecorator
+
+# 安装了zstandard时使用，否则退回标准库zlib
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+MARKER = "\x01"
+ZSTD_PREFIX = MARKER + "zs:"
+ZLIB_PREFIX = MARKER + "zl:"
+RAW_PREFIX = MARKER + "r:"
+
+# 超过该字节数的消息才压缩，0表示关闭压缩
+COMPRESS_THRESHOLD = int(os.getenv("MESSAGE_COMPRESS_THRESHOLD", "2048"))
+
+# 压缩级别，zstd 1-22 / zlib 1-9
+COMPRESS_LEVEL = int(os.getenv("MESSAGE_COMPRESS_LEVEL", "6"))
+
+# 启动时是否在后台压缩已有的消息
+COMPRESS_BACKFILL = os.getenv("MESSAGE_COMPRESS_BACKFILL", "0").lower() in ("1", "true", "yes", "on")
+
+# 后台压缩每批之间的停顿秒数，降低对线上查询的影响
+COMPRESS_BACKFILL_PAUSE = float(os.getenv("MESSAGE_COMPRESS_BACKFILL_PAUSE", "0.2"))
+
+_local = threading.local()
+
+_backfill_thread = None
+
+
+def _zstd_compressor():
+    # 压缩器不是线程安全的，每个线程各持有一个
+    if not hasattr(_local, "compressor"):
+        _local.compressor = zstandard.ZstdCompressor(level=COMPRESS_LEVEL)
+        _local.decompressor = zstandard.ZstdDecompressor()
+    return _local.compressor, _local.decompressor
+
+
+def compress_text(value: str, threshold: int = COMPRESS_THRESHOLD) -> str:
+    """
+    将消息内容编码为存储格式，压缩后没有变小时保留原文
+    """
+    if value.startswith(MARKER):
+        value = RAW_PREFIX + value
+    data = value.encode("utf-8")
+    if threshold <= 0 or len(data) < threshold:
+        return value
+
+    if zstandard is not None:
+        prefix, compressed = ZSTD_PREFIX, _zstd_compressor()[0].compress(data)
+    else:
+        prefix, compressed = ZLIB_PREFIX, zlib.compress(data, min(COMPRESS_LEVEL, 9))
+    encoded = prefix + base64.b64encode(compressed).decode("ascii")
+    return encoded if len(encoded) < len(data) else value
+
+
+def decompress_text(value: str) -> str:
+    """
+    将存储格式还原为消息内容
+    """
+    if not value.startswith(MARKER):
+        return value
+    if value.startswith(RAW_PREFIX):
+        return value[len(RAW_PREFIX):]
+    if value.startswith(ZLIB_PREFIX):
+        return zlib.decompress(base64.b64decode(value[len(ZLIB_PREFIX):])).decode("utf-8")
+    if value.startswith(ZSTD_PREFIX):
+        if zstandard is None:
+            raise RuntimeError("消息使用zstd压缩，需要安装 zstandard")
+        data = base64.b64decode(value[len(ZSTD_PREFIX):])
+        return _zstd_compressor()[1].decompress(data).decode("utf-8")
+    return value
+
+
+def is_compressed(value: str) -> bool:
+    return value.startswith(ZSTD_PREFIX) or value.startswith(ZLIB_PREFIX)
+
+
+class CompressedText(TypeDecorator):
+    """
+    写入时压缩、读取时解压的文本列，数据库中仍为 Text
+    """
+
+    impl = Text
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return compress_text(value)
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return decompress_text(value)
+
+
+def compress_existing_messages(engine, batch_size: int = 500, pause: float = 0.0) -> dict:
+    """
+    按主键分批压缩已有的未压缩消息，每批一个事务，可重复执行
+    """
+    from app.models import Message
+
+    table = Message.__table__
+    # 按原始文本读写，跳过列类型的压缩与解压处理
+    raw_content = type_coerce(table.c.content, Text)
+    stats = {"scanned": 0, "compressed": 0, "bytes_before": 0, "bytes_after": 0}
+    if COMPRESS_THRESHOLD <= 0:
+        return stats
+
+    stmt = (
+        update(table)
+        .where(table.c.id == bindparam("message_id"))
+        .values(content=bindparam("content", type_=Text()))
+    )
+    last_id = 0
+    while True:
+        with engine.begin() as connection:
+            rows = connection.execute(
+                table.select().with_only_columns(table.c.id, raw_content)
+                .where(table.c.id > last_id, raw_content.isnot(None), ~raw_content.startswith(MARKER))
+                .order_by(table.c.id).limit(batch_size)
+            ).all()
+            params = []
+            for message_id, content in rows:
+                size = len(content.encode("utf-8"))
+                if size < COMPRESS_THRESHOLD:
+                    continue
+                encoded = compress_text(content)
+                if not is_compressed(encoded):
+                    continue
+                params.append({"message_id": message_id, "content": encoded})
+                stats["bytes_before"] += size
+                stats["bytes_after"] += len(encoded)
+            if params:
+                connection.execute(stmt, params)
+        stats["scanned"] += len(rows)
+        stats["compressed"] += len(params)
+        if len(rows) < batch_size:
+            break
+        last_id = rows[-1][0]
+        if pause:
+            time.sleep(pause)
+
+    logger.info("消息压缩完成: 扫描 %(scanned)d 条, 压缩 %(compressed)d 条, "
+                "%(bytes_before)d -> %(bytes_after)d 字节", stats)
+    return stats
+
+
+def start_compression_backfill(engine) -> threading.Thread:
+    """
+    在后台线程中压缩已有消息，每个进程只启动一次
+    """
+    global _backfill_thread
+    if _backfill_thread is not None:
+        return _backfill_thread
+
+    def run():
+        try:
+            compress_existing_messages(engine, pause=COMPRESS_BACKFILL_PAUSE)
+        except Exception:
+            logger.exception("后台压缩消息失败")
+
+    _backfill_thread = threading.Thread(target=run, name="message-compression", daemon=True)
+    _backfill_thread.start()
+    return _backfill_thread
@@ -1,7 +1,13 @@
-from sqlalchemy import create_engine
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session, declarative_base, sessionmaker
+from sqlalchemy.pool import QueuePool
+from starlette.requests import Request
+import contextvars
+import math
 import os
+import threading
+import time
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -9,15 +15,117 @@ load_dotenv()
 # 获取数据库URL
 DATABASE_URL = os.getenv("DATABASE_URL")
 
+# 只读副本URL，未设置时读请求也走主库
+DATABASE_REPLICA_URL = os.getenv("DATABASE_REPLICA_URL")
+
+# 用户写入后在该秒数内，其读请求仍走主库，避免副本延迟导致读不到刚写入的数据
+REPLICA_STICKY_SECONDS = float(os.getenv("DB_REPLICA_STICKY_SECONDS", "5"))
+
+# 写入时间随响应返回给客户端(Cookie和响应头)，后续读请求无论落在哪个工作进程都能据此改查主库
+WRITE_MARKER_COOKIE = "last_write"
+WRITE_MARKER_HEADER = "X-Last-Write"
+
+
+class PoolWaitStats:
+    """连接池获取连接的等待时间统计"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def record(self, seconds: float):
+        with self._lock:
+            self.checkouts += 1
+            self.total_wait += seconds
+            if seconds > self.max_wait:
+                self.max_wait = seconds
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "checkouts": self.checkouts,
+                "avg_wait_ms": round(self.total_wait / self.checkouts * 1000, 3) if self.checkouts else 0.0,
+                "max_wait_ms": round(self.max_wait * 1000, 3),
+            }
+
+
+class TimedQueuePool(QueuePool):
+    """记录每次获取连接等待时间的连接池"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.wait_stats = PoolWaitStats()
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            self.wait_stats.record(time.perf_counter() - started)
+
+
+def pool_setting(prefix: str, name: str, default: str) -> str:
+    """读取连接池配置，副本未单独配置时沿用主库配置"""
+    return os.getenv(f"{prefix}_{name}", os.getenv(f"DB_{name}", default))
+
+
+def create_db_engine(url: str, prefix: str = "DB"):
+    """
+    按环境变量配置连接池创建引擎，例如 DB_POOL_SIZE / DB_REPLICA_POOL_SIZE
+    """
+    kwargs = {}
+    if url.startswith("sqlite"):
+        # SQLite连接会在线程池与事件循环之间传递，需关闭同线程检查
+        kwargs["connect_args"] = {"check_same_thread": False}
+    if url.startswith("sqlite") and ":memory:" in url:
+        # 内存数据库只能使用SQLAlchemy默认的单连接池
+        return create_engine(url, **kwargs)
+
+    return create_engine(
+        url,
+        poolclass=TimedQueuePool,
+        pool_size=int(pool_setting(prefix, "POOL_SIZE", "5")),
+        max_overflow=int(pool_setting(prefix, "MAX_OVERFLOW", "10")),
+        pool_timeout=float(pool_setting(prefix, "POOL_TIMEOUT", "30")),
+        pool_recycle=int(pool_setting(prefix, "POOL_RECYCLE", "1800")),
+        pool_pre_ping=pool_setting(prefix, "POOL_PRE_PING", "1").lower() in ("1", "true", "yes", "on"),
+        **kwargs,
+    )
+
+
 # 创建数据库引擎
-engine = create_engine(DATABASE_URL)
+engine = create_db_engine(DATABASE_URL)
+replica_engine = create_db_engine(DATABASE_REPLICA_URL, "DB_REPLICA") if DATABASE_REPLICA_URL else engine
 
 # 创建会话工厂
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
-# 创建基类
+
+class RoutingSession(Session):
+    """只读会话：默认查询副本，info["use_primary"] 为真时改查主库"""
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if self.info.get("use_primary"):
+            return engine
+        return replica_engine
+
+
+ReadSessionLocal = sessionmaker(class_=RoutingSession, autocommit=False, autoflush=False)
+
+# 创建基类，所有模型共用同一份元数据
 Base = declarative_base()
 
+# 应用启动时是否自动建表；多进程部署时由主进程或迁移步骤统一执行
+DB_AUTO_CREATE = os.getenv("DB_AUTO_CREATE", "1").lower() in ("1", "true", "yes", "on")
+
+# 用户最近一次写入的时间(进程内)，用于读己之写
+_recent_writes = {}
+
+# 当前请求中的写入记录，由 WriteMarkerMiddleware 设置
+_request_writes = contextvars.ContextVar("request_writes", default=None)
+
 
 # 依赖项函数，用于获取数据库会话
 def get_db():
@@ -25,4 +133,132 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+
+# 依赖项函数，用于获取只读数据库会话
+def get_read_db(request: Request):
+    db = ReadSessionLocal()
+    if client_wrote_recently(request):
+        db.info["use_primary"] = True
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+def mark_user_write(user_id: int):
+    """记录用户刚刚提交了写入；在请求中调用时，写入时间还会随响应返回给客户端"""
+    if replica_engine is engine:
+        return
+    holder = _request_writes.get()
+    if holder is not None:
+        holder["written_at"] = time.time()
+    now = time.monotonic()
+    if len(_recent_writes) > 10000:
+        for key, written in list(_recent_writes.items()):
+            if now - written >= REPLICA_STICKY_SECONDS:
+                _recent_writes.pop(key, None)
+    _recent_writes[user_id] = now
+
+
+def client_wrote_recently(request: Request) -> bool:
+    """客户端带回的写入时间是否仍在主库读取窗口内"""
+    value = request.headers.get(WRITE_MARKER_HEADER) or request.cookies.get(WRITE_MARKER_COOKIE)
+    try:
+        age = time.time() - float(value)
+    except (TypeError, ValueError):
+        return False
+    # 允许不同机器间少量的时钟偏差
+    return -REPLICA_STICKY_SECONDS < age < REPLICA_STICKY_SECONDS
+
+
+class WriteMarkerMiddleware:
+    """
+    请求中有写入时，在响应中带上写入时间：Cookie last_write 和响应头 X-Last-Write。
+    浏览器自动带回Cookie；不保存Cookie的客户端可在后续请求中原样带上 X-Last-Write 请求头
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or replica_engine is engine:
+            await self.app(scope, receive, send)
+            return
+
+        holder = {}
+        token = _request_writes.set(holder)
+
+        async def send_with_marker(message):
+            if message["type"] == "http.response.start" and "written_at" in holder:
+                value = f"{holder['written_at']:.3f}"
+                cookie = (f"{WRITE_MARKER_COOKIE}={value}; Max-Age={math.ceil(REPLICA_STICKY_SECONDS)}; "
+                          "Path=/; HttpOnly; SameSite=Lax")
+                headers = list(message.get("headers", []))
+                headers.append((b"set-cookie", cookie.encode("latin-1")))
+                headers.append((WRITE_MARKER_HEADER.lower().encode("latin-1"), value.encode("latin-1")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_marker)
+        finally:
+            _request_writes.reset(token)
+
+
+def route_reads_for_user(db: Session, user_id: int):
+    """用户刚写入过时，让该只读会话改查主库"""
+    written = _recent_writes.get(user_id)
+    if written is None:
+        return
+    if time.monotonic() - written < REPLICA_STICKY_SECONDS:
+        db.info["use_primary"] = True
+    else:
+        _recent_writes.pop(user_id, None)
+
+
+def init_db():
+    """
+    创建所有数据表（已存在的表不受影响）
+    """
+    import app.models  # noqa: F401  注册模型到元数据
+    from app.search import ensure_search_index
+
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as connection:
+        ensure_search_index(connection)
+
+
+def warm_up_database() -> bool:
+    """
+    预先建立主库和副本的连接并放回连接池，连接成功时返回True
+    """
+    try:
+        for db_engine in {engine, replica_engine}:
+            with db_engine.connect() as connection:
+                connection.execute(text("SELECT 1"))
+        return True
+    except SQLAlchemyError:
+        return False
+
+
+def pool_stats() -> dict:
+    """
+    各连接池的占用情况与获取连接的等待时间
+    """
+    stats = {}
+    for name, db_engine in (("primary", engine), ("replica", replica_engine)):
+        if name == "replica" and db_engine is engine:
+            continue
+        pool = db_engine.pool
+        item = {"status": pool.status()}
+        if isinstance(pool, TimedQueuePool):
+            item.update(
+                size=pool.size(),
+                checked_out=pool.checkedout(),
+                overflow=pool.overflow(),
+                **pool.wait_stats.snapshot(),
+            )
+        stats[name] = item
+    return stats
@@ -0,0 +1,106 @@
+import asyncio
+import logging
+import os
+import signal
+from typing import AsyncGenerator
+
+from fastapi import HTTPException, status
+from sse_starlette import sse
+from uvicorn.server import Server
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# 收到SIGTERM后，等待进行中的SSE回答结束的最长秒数
+SSE_DRAIN_TIMEOUT = float(os.getenv("SSE_DRAIN_TIMEOUT", "30"))
+
+# 排空期间关闭空闲连接的间隔秒数
+IDLE_CONNECTION_SWEEP_SECONDS = 0.5
+
+
+class ServerState:
+    """当前进程的运行状态"""
+
+    def __init__(self):
+        self.draining = False      # 是否已收到停机信号
+        self.active_streams = 0    # 进行中的SSE回答数
+        self.db_ready = False      # 数据库连接池是否已预热
+        self.upstream_ready = False  # 上游LLM连接池是否已预热
+        self.import_seconds = None   # 导入应用模块耗时
+        self.startup_seconds = None  # 启动阶段初始化耗时
+
+    @property
+    def ready(self) -> bool:
+        return self.db_ready and self.upstream_ready and not self.draining
+
+
+state = ServerState()
+
+
+def ensure_accepting_streams():
+    """停机排空期间拒绝新的流式请求"""
+    if state.draining:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="服务正在停机，请稍后重试",
+            headers={"Retry-After": "5"},
+        )
+
+
+async def track_stream(generator: AsyncGenerator[str, None]) -> AsyncGenerator[str, None]:
+    """统计进行中的SSE回答"""
+    state.active_streams += 1
+    try:
+        async for chunk in generator:
+            yield chunk
+    finally:
+        state.active_streams -= 1
+
+
+def stop_streams():
+    """通知sse-starlette结束所有仍在进行的流"""
+    if state.active_streams:
+        logger.warning("排空超时，强制结束 %d 个进行中的SSE回答", state.active_streams)
+    sse.AppStatus.should_exit = True
+    if sse.AppStatus.should_exit_event is not None:
+        sse.AppStatus.should_exit_event.set()
+
+
+def close_idle_connections(server: Server):
+    """
+    关闭空闲的keep-alive连接，进行中的请求在响应结束后关闭连接。
+    Python 3.12 下 uvicorn 停机时先等待所有连接关闭(wait_closed)才处理空闲连接，
+    不主动关闭的话会一直等到keep-alive超时
+    """
+    for connection in list(server.server_state.connections):
+        connection.shutdown()
+    # 停止监听前仍可能有新连接进来，排空期间持续检查
+    asyncio.get_running_loop().call_later(IDLE_CONNECTION_SWEEP_SECONDS, close_idle_connections, server)
+
+
+# sse-starlette 会把uvicorn的退出信号处理替换为立即结束所有流，
+# 这里改为先停止接收新连接，等进行中的回答完成或超时后再结束流
+_uvicorn_handle_exit = getattr(sse, "original_handler", Server.handle_exit)
+
+
+def _handle_exit(server, sig, frame):
+    if state.draining and sig == signal.SIGINT:
+        # 再次Ctrl+C时立即退出
+        stop_streams()
+    elif not state.draining:
+        state.draining = True
+        logger.info("开始排空，进行中的SSE回答: %d，最长等待 %.0f 秒", state.active_streams, SSE_DRAIN_TIMEOUT)
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            stop_streams()
+        else:
+            loop.call_later(SSE_DRAIN_TIMEOUT, stop_streams)
+            close_idle_connections(server)
+    _uvicorn_handle_exit(server, sig, frame)
+
+
+def install_drain_handler():
+    Server.handle_exit = _handle_exit
@@ -1,9 +1,12 @@
 import httpx
-import json
 import asyncio
-from typing import List, AsyncGenerator
+from typing import List, AsyncGenerator, Optional
+from urllib.parse import urlsplit
 from sse_starlette.sse import EventSourceResponse
 from app.schemas import LLMRequest, LLMResponse
+from app.lifecycle import track_stream
+from app.serialization import dumps
+from app.usage import meter_stream
 import os
 from dotenv import load_dotenv
 
@@ -14,9 +17,51 @@ TIR_API_URL = os.getenv("TIR_API_URL")
 TOT_API_URL = os.getenv("TOT_API_URL")
 COT_API_URL = os.getenv("COT_API_URL")
 
-print("TIR_API_URL:", TIR_API_URL)
-print("TOT_API_URL:", TOT_API_URL)
-print("COT_API_URL:", COT_API_URL)
+# 上游连接池大小
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "200"))
+LLM_MAX_KEEPALIVE = int(os.getenv("LLM_MAX_KEEPALIVE", "50"))
+
+# 全局HTTP客户端，复用到上游模型服务的连接
+http_client: Optional[httpx.AsyncClient] = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """获取共享的上游HTTP客户端"""
+    global http_client
+    if http_client is None:
+        http_client = httpx.AsyncClient(limits=httpx.Limits(
+            max_connections=LLM_MAX_CONNECTIONS,
+            max_keepalive_connections=LLM_MAX_KEEPALIVE,
+        ))
+    return http_client
+
+
+async def close_http_client():
+    global http_client
+    if http_client is not None:
+        await http_client.aclose()
+        http_client = None
+
+
+async def warm_up_upstreams() -> bool:
+    """
+    预先建立到各上游服务的连接，全部可达时返回True
+    """
+    origins = set()
+    for url in (TIR_API_URL, COT_API_URL, TOT_API_URL):
+        if url:
+            parts = urlsplit(url)
+            origins.add(f"{parts.scheme}://{parts.netloc}/")
+
+    client = get_http_client()
+    for origin in origins:
+        try:
+            # 任何HTTP响应都说明连接已建立并留在连接池中
+            await client.request("HEAD", origin, timeout=5.0)
+        except httpx.HTTPError:
+            return False
+    return True
+
 
 async def call_llm_api(query: str, history_chat: List[str], model:str) -> AsyncGenerator[str, None]:
     """
@@ -29,23 +74,23 @@ async def call_llm_api(query: str, history_chat: List[str], model:str) -> AsyncG
 
     url = TIR_API_URL if model == 'tir' else COT_API_URL
 
-    async with httpx.AsyncClient() as client:
-        async with client.stream('POST', url, json=request_data, timeout=60.0) as response:
-            if response.status_code != 200:
-                error_msg = json.dumps({
-                    "status": -1,
-                    "error": f"LLM API请求失败: {response.status_code}",
-                    "answer": ""
-                })
-                yield f"data:{error_msg}\n\n"
-                return
-
-            async for chunk in response.aiter_text():
-                if chunk.startswith('data:'):
-                    yield chunk
-                else:
-                    # 确保格式正确
-                    yield f"data:{chunk}\n\n"
+    client = get_http_client()
+    async with client.stream('POST', url, json=request_data, timeout=60.0) as response:
+        if response.status_code != 200:
+            error_msg = dumps({
+                "status": -1,
+                "error": f"LLM API请求失败: {response.status_code}",
+                "answer": ""
+            })
+            yield f"data:{error_msg}\n\n"
+            return
+
+        async for chunk in response.aiter_text():
+            if chunk.startswith('data:'):
+                yield chunk
+            else:
+                # 确保格式正确
+                yield f"data:{chunk}\n\n"
 
 
 async def call_tot_api(query: str) -> AsyncGenerator[str, None]:
@@ -53,43 +98,43 @@ async def call_tot_api(query: str) -> AsyncGenerator[str, None]:
         "query": query
     }
 
-    async with httpx.AsyncClient() as client:
-        async with client.stream('POST', TOT_API_URL, json=request_data, timeout=180.0) as response:
-            if response.status_code != 200:
-                error_msg = json.dumps({
-                    "status": -1,
-                    "error": f"LLM API请求失败: {response.status_code}",
-                    "answer": ""
-                })
-                yield f"data:{error_msg}\n\n"
-                return
-
-            async for chunk in response.aiter_text():
-                if chunk.startswith('data:'):
-                    yield chunk
-                else:
-                    # 确保格式正确
-                    yield f"data:{chunk}\n\n"
-
-
-async def process_llm_request(request: LLMRequest) -> EventSourceResponse:
+    client = get_http_client()
+    async with client.stream('POST', TOT_API_URL, json=request_data, timeout=180.0) as response:
+        if response.status_code != 200:
+            error_msg = dumps({
+                "status": -1,
+                "error": f"LLM API请求失败: {response.status_code}",
+                "answer": ""
+            })
+            yield f"data:{error_msg}\n\n"
+            return
+
+        async for chunk in response.aiter_text():
+            if chunk.startswith('data:'):
+                yield chunk
+            else:
+                # 确保格式正确
+                yield f"data:{chunk}\n\n"
+
+
+async def process_llm_request(request: LLMRequest, user_id: Optional[int] = None) -> EventSourceResponse:
     """
-    处理LLM请求并返回SSE响应
+    处理LLM请求并返回SSE响应，传入 user_id 时统计该用户的用量
     """
-    return EventSourceResponse(
-        call_llm_api(request.query, request.history_chat, request.model),
-        media_type="text/event-stream"
-    )
+    stream = call_llm_api(request.query, request.history_chat, request.model)
+    if user_id is not None:
+        stream = meter_stream(stream, user_id, request.model)
+    return EventSourceResponse(track_stream(stream), media_type="text/event-stream")
 
 
-async def process_tot_request(request: LLMRequest) -> EventSourceResponse:
+async def process_tot_request(request: LLMRequest, user_id: Optional[int] = None) -> EventSourceResponse:
     """
-    处理LLM请求并返回SSE响应
+    处理LLM请求并返回SSE响应，传入 user_id 时统计该用户的用量
     """
-    return EventSourceResponse(
-        call_tot_api(request.query),
-        media_type="text/event-stream"
-    )
+    stream = call_tot_api(request.query)
+    if user_id is not None:
+        stream = meter_stream(stream, user_id, "tot")
+    return EventSourceResponse(track_stream(stream), media_type="text/event-stream")
 
 
 async def format_history_for_llm(conversation_messages) -> List[str]:
@@ -1,13 +1,9 @@
-from sqlalchemy import Column, Integer, String, Text, ForeignKey, DateTime, Boolean, create_engine
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import relationship
+from sqlalchemy import BigInteger, Column, Integer, String, ForeignKey, DateTime, Boolean, Float, UniqueConstraint
+from sqlalchemy.orm import deferred, relationship
 from datetime import datetime
-import os
-from dotenv import load_dotenv
 
-load_dotenv()
-
-Base = declarative_base()
+from app.compression import CompressedText
+from app.database import Base
 
 
 class User(Base):
@@ -42,15 +38,23 @@ class Message(Base):
     id = Column(Integer, primary_key=True, index=True)
     conversation_id = Column(Integer, ForeignKey("conversations.id"))
     is_user = Column(Boolean, default=True)  # True表示用户消息，False表示AI回复
-    content = Column(Text)
+    # 长消息压缩存储；按对象查询时默认不加载内容，需要时用 undefer(Message.content)
+    content = deferred(Column(CompressedText))
     created_at = Column(DateTime, default=datetime.utcnow)
 
     conversation = relationship("Conversation", back_populates="messages")
 
 
-# 创建数据库连接
-database_url = os.getenv("DATABASE_URL")
-engine = create_engine(database_url)
+class UsageRollup(Base):
+    __tablename__ = "usage_rollups"
+    __table_args__ = (UniqueConstraint("user_id", "model", "bucket_start", name="uq_usage_rollups_bucket"),)
 
-# 创建表
-Base.metadata.create_all(bind=engine)
\ No newline at end of file
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    model = Column(String(16), nullable=False)  # tir / cot / tot / ocr
+    bucket_start = Column(DateTime, nullable=False)  # 时间桶起点(UTC)
+    requests = Column(Integer, default=0, nullable=False)
+    events = Column(Integer, default=0, nullable=False)  # SSE事件数
+    answer_chars = Column(BigInteger, default=0, nullable=False)
+    ocr_pages = Column(Integer, default=0, nullable=False)
+    generation_seconds = Column(Float, default=0, nullable=False)
@@ -7,6 +7,7 @@ import httpx
 from typing import Dict, Any, Optional
 import os
 from app.schemas import OCRResponse, TextItem
+from app.serialization import dumps, dumps_bytes, loads
 
 
 class TencentOCRService:
@@ -21,6 +22,8 @@ class TencentOCRService:
         self.service = "ocr"
         self.version = "2018-11-19"
         self.action = "EduPaperOCR"
+        # 请求地址，可覆盖为本地替身服务（如压测时的假OCR服务）
+        self.url = os.getenv("TENCENT_OCR_URL", f"https://{self.endpoint}")
         
         if not self.secret_id or not self.secret_key:
             raise ValueError("请在环境变量中设置 TENCENT_SECRET_ID 和 TENCENT_SECRET_KEY")
@@ -29,8 +32,8 @@ class TencentOCRService:
         """签名函数"""
         return hmac.new(key, msg.encode("utf-8"), hashlib.sha256).digest()
     
-    def get_authorization(self, params: Dict[str, Any]) -> str:
-        """生成腾讯云API授权头"""
+    def get_authorization(self, payload: bytes) -> str:
+        """生成腾讯云API授权头，payload为实际发送的请求体"""
         # 获取当前时间戳
         timestamp = int(datetime.datetime.now().timestamp())
         date = datetime.datetime.utcfromtimestamp(timestamp).strftime("%Y-%m-%d")
@@ -41,8 +44,7 @@ class TencentOCRService:
         canonical_querystring = ""
         canonical_headers = f"content-type:application/json; charset=utf-8\nhost:{self.endpoint}\n"
         signed_headers = "content-type;host"
-        payload = json.dumps(params)
-        hashed_request_payload = hashlib.sha256(payload.encode("utf-8")).hexdigest()
+        hashed_request_payload = hashlib.sha256(payload).hexdigest()
         canonical_request = f"{http_request_method}\n{canonical_uri}\n{canonical_querystring}\n{canonical_headers}\n{signed_headers}\n{hashed_request_payload}"
         
         # 拼接待签名字符串
@@ -77,11 +79,13 @@ class TencentOCRService:
             # 准备请求参数
             params = {
                 "ImageBase64": image_base64,
-                "Config": json.dumps(config) if config else json.dumps({"task_type": 1, "is_structuralization": True})
+                "Config": dumps(config) if config else dumps({"task_type": 1, "is_structuralization": True})
             }
+            # 请求体只序列化一次，签名与发送使用同一份内容
+            payload = dumps_bytes(params)
             
             # 生成授权头
-            authorization, timestamp = self.get_authorization(params)
+            authorization, timestamp = self.get_authorization(payload)
             
             # 准备请求头
             headers = {
@@ -95,11 +99,10 @@ class TencentOCRService:
             }
             
             # 使用httpx发送同步请求
-            url = f"https://{self.endpoint}"
             with httpx.Client(timeout=30.0) as client:
-                response = client.post(url, headers=headers, json=params)
+                response = client.post(self.url, headers=headers, content=payload)
                 response.raise_for_status()
-                result = response.json()
+                result = loads(response.content)
             
             # 处理响应
             if "Error" in result.get("Response", {}):
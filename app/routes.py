@@ -1,22 +1,85 @@
-from fastapi import FastAPI, Depends, HTTPException, status, Request
+import time
+
+# 记录应用模块开始导入的时间，用于统计启动耗时
+_import_started = time.perf_counter()
+
+from fastapi import FastAPI, Depends, HTTPException, Query, status, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
-from datetime import timedelta
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
 from typing import List
 
-from app.database import get_db, engine
-from app.models import Base, User, Conversation, Message
-from app.schemas import TOTRequest, UserCreate, UserResponse, Token, ConversationCreate, ConversationResponse, MessageCreate, MessageResponse, LLMRequest, OCRRequest, OCRResponse
+from app.database import engine, get_db, get_read_db, init_db, warm_up_database, mark_user_write, route_reads_for_user, pool_stats, DB_AUTO_CREATE, WriteMarkerMiddleware, WRITE_MARKER_HEADER
+from app.models import User, Conversation, Message
+from app.schemas import TOTRequest, UserCreate, UserResponse, Token, ConversationCreate, ConversationResponse, MessageCreate, MessageResponse, LLMRequest, OCRRequest, OCRResponse, SearchResponse, UsageResponse
 from app.auth import authenticate_user, create_access_token, get_password_hash, get_current_active_user, ACCESS_TOKEN_EXPIRE_MINUTES
-from app.llm_service import process_llm_request, format_history_for_llm, process_tot_request
-from app.ocr_service import get_ocr_service
+from app.llm_service import process_llm_request, format_history_for_llm, process_tot_request, warm_up_upstreams, close_http_client
+from app.lifecycle import state, ensure_accepting_streams, install_drain_handler
+from app.serialization import FastJSONResponse
+from app.search import search
+from app.compression import COMPRESS_BACKFILL, start_compression_backfill
+from app.write_behind import get_write_buffer, merge_pending, stop_write_buffer
+from app.usage import charge_request, get_usage_tracker, stop_usage_tracker, usage_report
+from app.transfer_service import ImportFormatError, UserDataImporter, export_user_data, iter_ndjson
+
+logger = logging.getLogger(__name__)
+
+# 列表接口按响应模型的字段顺序直接查询列，跳过逐个对象的模型校验
+CONVERSATION_COLUMNS = (Conversation.title, Conversation.id, Conversation.user_id,
+                        Conversation.created_at, Conversation.updated_at)
+MESSAGE_COLUMNS = (Message.content, Message.is_user, Message.id,
+                   Message.conversation_id, Message.created_at)
+
+
+def title_from_message(content: str) -> str:
+    # 截取用户消息的前30个字符作为标题，如果超过30个字符则添加...
+    return content[:30] + ('...' if len(content) > 30 else '')
+
+
+async def warm_up():
+    """
+    预热数据库和上游连接池，结果记录在就绪状态中
+    """
+    if not state.db_ready:
+        state.db_ready = await run_in_threadpool(warm_up_database)
+    if not state.upstream_ready:
+        state.upstream_ready = await warm_up_upstreams()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    应用生命周期：启动时建表并预热连接池，停止时写完缓冲和用量并释放上游连接
+    """
+    started = time.perf_counter()
+    if DB_AUTO_CREATE:
+        await run_in_threadpool(init_db)
+    # 后台预热，不阻塞启动；未完成前 /ready 返回503
+    asyncio.create_task(warm_up())
+    if COMPRESS_BACKFILL:
+        start_compression_backfill(engine)
+    get_write_buffer()
+    get_usage_tracker()
+    state.startup_seconds = time.perf_counter() - started
+    logger.info("应用启动完成: 导入 %.3fs, 初始化 %.3fs", state.import_seconds, state.startup_seconds)
+    yield
+    # 写完缓冲中尚未提交的消息
+    await run_in_threadpool(stop_write_buffer)
+    await run_in_threadpool(stop_usage_tracker)
+    await close_http_client()
 
-# 创建数据库表
-Base.metadata.create_all(bind=engine)
 
 # 创建FastAPI应用
-app = FastAPI(title="数学问答平台")
+app = FastAPI(title="数学问答平台", lifespan=lifespan, default_response_class=FastJSONResponse)
+
+# 停机时先排空进行中的SSE回答
+install_drain_handler()
 
 # 添加CORS中间件
 app.add_middleware(
@@ -25,8 +88,12 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[WRITE_MARKER_HEADER],
 )
 
+# 写入后在响应中带上写入时间，读己之写在多个工作进程间也成立
+app.add_middleware(WriteMarkerMiddleware)
+
 
 @app.post("/api/users/register", response_model=UserResponse, status_code=status.HTTP_201_CREATED)
 async def register_user(user: UserCreate, db: Session = Depends(get_db)):
@@ -85,6 +152,17 @@ async def read_users_me(current_user=Depends(get_current_active_user)):
     return current_user
 
 
+# 获取当前用户的用量
+@app.get("/api/users/me/usage", response_model=UsageResponse)
+async def read_my_usage(days: int = Query(7, ge=1, le=90), current_user=Depends(get_current_active_user),
+                        db: Session = Depends(get_read_db)):
+    """
+    最近 days 天(UTC，含今天)按天、按模型的请求数、SSE事件数、回答字数、OCR页数和生成耗时，
+    以及今日用量和每日配额
+    """
+    return usage_report(db, current_user.id, days)
+
+
 # 创建新对话
 @app.post("/api/conversations", response_model=ConversationResponse)
 async def create_conversation(conversation: ConversationCreate, current_user=Depends(get_current_active_user), db: Session = Depends(get_db)):
@@ -97,49 +175,83 @@ async def create_conversation(conversation: ConversationCreate, current_user=Dep
     )
     db.add(db_conversation)
     db.commit()
+    mark_user_write(current_user.id)
     db.refresh(db_conversation)
     return db_conversation
 
 
 # 获取用户的所有对话
 @app.get("/api/conversations", response_model=List[ConversationResponse])
-async def get_conversations(current_user=Depends(get_current_active_user), db: Session = Depends(get_db)):
+async def get_conversations(current_user=Depends(get_current_active_user), db: Session = Depends(get_read_db)):
     """
     获取当前用户的所有对话列表
     """
-    conversations = db.query(Conversation).filter(
+    rows = db.query(*CONVERSATION_COLUMNS).filter(
         Conversation.user_id == current_user.id).all()
-    return conversations
+    conversations = [row._asdict() for row in rows]
+    write_buffer = get_write_buffer()
+    if write_buffer is not None:
+        for item in conversations:
+            item.update(write_buffer.pending_conversation(item["id"]))
+    return FastJSONResponse(conversations)
 
 
 # 获取特定对话
 @app.get("/api/conversations/{conversation_id}", response_model=ConversationResponse)
-async def get_conversation(conversation_id: int, current_user=Depends(get_current_active_user), db: Session = Depends(get_db)):
+async def get_conversation(conversation_id: int, current_user=Depends(get_current_active_user), db: Session = Depends(get_read_db)):
     """
     获取指定ID的对话信息
     """
-    conversation = db.query(Conversation).filter(
+    row = db.query(*CONVERSATION_COLUMNS).filter(
         Conversation.id == conversation_id, Conversation.user_id == current_user.id).first()
-    if not conversation:
+    if not row:
         raise HTTPException(status_code=404, detail="对话不存在")
-    return conversation
+    conversation = row._asdict()
+    write_buffer = get_write_buffer()
+    if write_buffer is not None:
+        conversation.update(write_buffer.pending_conversation(conversation_id))
+    return FastJSONResponse(conversation)
 
 
 # 获取对话的所有消息
 @app.get("/api/conversations/{conversation_id}/messages", response_model=List[MessageResponse])
-async def get_messages(conversation_id: int, current_user=Depends(get_current_active_user), db: Session = Depends(get_db)):
+async def get_messages(conversation_id: int, current_user=Depends(get_current_active_user), db: Session = Depends(get_read_db)):
     """
     获取指定对话的所有消息
     """
+    # 先写入该对话缓冲中的消息，写入后该用户的读请求改查主库
+    write_buffer = get_write_buffer()
+    if write_buffer is not None and write_buffer.pending_messages(conversation_id):
+        # 等待期间先归还连接，避免占满连接池
+        db.close()
+        await write_buffer.wait_for_conversation(conversation_id)
+        route_reads_for_user(db, current_user.id)
+
     # 验证对话存在且属于当前用户
-    conversation = db.query(Conversation).filter(
+    conversation = db.query(Conversation.id).filter(
         Conversation.id == conversation_id, Conversation.user_id == current_user.id).first()
     if not conversation:
         raise HTTPException(status_code=404, detail="对话不存在")
 
-    messages = db.query(Message).filter(
+    rows = db.query(*MESSAGE_COLUMNS).filter(
         Message.conversation_id == conversation_id).order_by(Message.created_at).all()
-    return messages
+    return FastJSONResponse([row._asdict() for row in rows])
+
+
+# 检索当前用户的对话历史
+@app.get("/api/search", response_model=SearchResponse)
+async def search_history(q: str = Query(..., min_length=1, max_length=200), page: int = Query(1, ge=1),
+                         page_size: int = Query(20, ge=1, le=100), current_user=Depends(get_current_active_user),
+                         db: Session = Depends(get_read_db)):
+    """
+    在当前用户的消息内容和对话标题中全文检索，按相关度排序并分页，
+    snippet 中用 <mark> 标出命中的词
+    """
+    try:
+        total, items = search(db, current_user.id, q, page, page_size)
+    except NotImplementedError as e:
+        raise HTTPException(status_code=status.HTTP_501_NOT_IMPLEMENTED, detail=str(e))
+    return {"total": total, "page": page, "page_size": page_size, "items": items}
 
 
 # 创建新消息并获取LLM回复
@@ -148,43 +260,69 @@ async def create_message(conversation_id: int, message: MessageCreate, model:str
     """
     创建新消息并获取LLM的回复
     """
+    ensure_accepting_streams()
+
     # 验证对话存在且属于当前用户
     conversation = db.query(Conversation).filter(
         Conversation.id == conversation_id, Conversation.user_id == current_user.id).first()
     if not conversation:
         raise HTTPException(status_code=404, detail="对话不存在")
 
-    # 保存用户消息
-    db_message = Message(
-        conversation_id=conversation_id,
-        content=message.content,
-        is_user=True
-    )
-    db.add(db_message)
-    db.commit()
-
-    # 检查是否是第一条消息，如果是则更新对话标题
-    message_count = db.query(Message).filter(Message.conversation_id == conversation_id).count()
-    if message_count == 1:
-        # 截取用户消息的前30个字符作为标题，如果超过30个字符则添加...
-        new_title = message.content[:30] + ('...' if len(message.content) > 30 else '')
-        conversation.title = new_title
-
-    # 更新对话的更新时间
-    conversation.updated_at = db.query(Message).filter(
-        Message.conversation_id == conversation_id).order_by(Message.created_at.desc()).first().created_at
-    db.commit()
+    # 对话存在才计入用量，访问不存在或他人的对话不消耗配额
+    charge_request(current_user.id, model)
+
+    messages = None
+    write_buffer = get_write_buffer()
+    if write_buffer is not None:
+        # 用户消息和对话更新进入写缓冲；历史消息由数据库中的和尚未写入的合并而成
+        pending = write_buffer.pending_messages(conversation_id)
+        stored = db.query(Message.id, Message.is_user, Message.content, Message.created_at).filter(
+            Message.conversation_id == conversation_id).order_by(Message.created_at).all()
+        messages = merge_pending(stored, pending)
+        user_message = write_buffer.add_message(conversation_id, current_user.id, message.content, is_user=True)
+        write_buffer.update_conversation(
+            conversation_id, current_user.id, updated_at=user_message.created_at,
+            title=None if messages else title_from_message(message.content))
+        messages.append(user_message)
+        # 用户消息写入后再开始回答，之后的读请求无论落在哪个工作进程都能查到；等待期间先归还连接
+        db.close()
+        await asyncio.wrap_future(user_message.future)
+    else:
+        # 保存用户消息
+        db_message = Message(
+            conversation_id=conversation_id,
+            content=message.content,
+            is_user=True
+        )
+        db.add(db_message)
+        db.commit()
+
+        # 检查是否是第一条消息，如果是则更新对话标题
+        message_count = db.query(Message).filter(Message.conversation_id == conversation_id).count()
+        if message_count == 1:
+            conversation.title = title_from_message(message.content)
+
+        # 更新对话的更新时间
+        conversation.updated_at = db.query(Message).filter(
+            Message.conversation_id == conversation_id).order_by(Message.created_at.desc()).first().created_at
+        db.commit()
+    # 缓冲中的写入稍后提交，同样在窗口期内让该用户的读请求走主库
+    mark_user_write(current_user.id)
     
+    # 流式回答期间不再使用数据库会话，先归还连接
     if model == 'tot':
+        db.close()
         llm_request = TOTRequest(
             query=message.content
         )
         # 返回流式响应
-        return await process_tot_request(llm_request)
+        return await process_tot_request(llm_request, current_user.id)
 
     # 获取历史消息
-    messages = db.query(Message).filter(
-        Message.conversation_id == conversation_id).order_by(Message.created_at).all()
+    if messages is None:
+        messages = db.query(Message.is_user, Message.content).filter(
+            Message.conversation_id == conversation_id).order_by(Message.created_at).all()
+    db.close()
     history_chat = await format_history_for_llm(messages)
 
     # 创建LLM请求
@@ -195,7 +333,7 @@ async def create_message(conversation_id: int, message: MessageCreate, model:str
     )
 
     # 返回流式响应
-    return await process_llm_request(llm_request)
+    return await process_llm_request(llm_request, current_user.id)
 
 
 # 直接调用LLM（无历史记录）
@@ -204,7 +342,9 @@ async def chat_with_llm(request: LLMRequest, current_user=Depends(get_current_ac
     """
     直接与LLM对话，不保存历史记录
     """
-    return await process_llm_request(request)
+    ensure_accepting_streams()
+    charge_request(current_user.id, request.model)
+    return await process_llm_request(request, current_user.id)
 
 
 @app.post("/api/tot/chat")
@@ -212,7 +352,9 @@ async def chat_with_tot(request: TOTRequest, current_user=Depends(get_current_ac
     """
     直接与LLM对话，不保存历史记录
     """
-    return await process_tot_request(request)
+    ensure_accepting_streams()
+    charge_request(current_user.id, "tot")
+    return await process_tot_request(request, current_user.id)
 
 
 @app.post("/api/conversations/{conversation_id}/save_response", response_model=MessageResponse)
@@ -226,6 +368,17 @@ async def save_llm_response(conversation_id: int, message: MessageCreate, curren
     if not conversation:
         raise HTTPException(status_code=404, detail="对话不存在")
 
+    write_buffer = get_write_buffer()
+    if write_buffer is not None:
+        # 与其他请求的写入合并提交，等待写入完成以返回消息ID
+        pending = write_buffer.add_message(conversation_id, current_user.id, message.content, is_user=False)
+        write_buffer.update_conversation(conversation_id, current_user.id, updated_at=pending.created_at)
+        mark_user_write(current_user.id)
+        # 等待期间先归还连接，避免占满连接池
+        db.close()
+        await asyncio.wrap_future(pending.future)
+        return pending._asdict()
+
     # 保存LLM回复
     db_message = Message(
         conversation_id=conversation_id,
@@ -233,14 +386,17 @@ async def save_llm_response(conversation_id: int, message: MessageCreate, curren
         is_user=False
     )
     db.add(db_message)
-    db.commit()
-    db.refresh(db_message)
+    db.flush()
 
-    # 更新对话的更新时间
+    # 更新对话的更新时间，与消息在同一事务中提交
     conversation.updated_at = db_message.created_at
+    # 提交后对象会过期，先取出返回值，避免为读取(压缩存储的)内容再查询一次
+    response = {"content": message.content, "is_user": False, "id": db_message.id,
+                "conversation_id": conversation_id, "created_at": db_message.created_at}
     db.commit()
+    mark_user_write(current_user.id)
 
-    return db_message
+    return response
 
 
 @app.patch("/api/conversations/{conversation_id}")
@@ -254,11 +410,57 @@ async def update_conversation(conversation_id: int, title: str, current_user=Dep
     if not conversation:
         raise HTTPException(status_code=404, detail="对话不存在")
 
+    write_buffer = get_write_buffer()
+    if write_buffer is not None:
+        # 经写缓冲更新，保证与缓冲中较早的标题修改按顺序生效
+        updated_at = datetime.utcnow()
+        write_buffer.update_conversation(conversation_id, current_user.id, updated_at=updated_at, title=title)
+        mark_user_write(current_user.id)
+        return {"title": title, "id": conversation.id, "user_id": conversation.user_id,
+                "created_at": conversation.created_at, "updated_at": updated_at}
+
     conversation.title = title
     db.commit()
+    mark_user_write(current_user.id)
     return conversation
 
 
+# 导出当前用户的全部对话和消息
+@app.get("/api/users/me/export")
+async def export_my_data(current_user=Depends(get_current_active_user), db: Session = Depends(get_read_db)):
+    """
+    以NDJSON流式导出当前用户的全部对话和消息，服务端游标分批读取，内存占用与数据量无关
+    """
+    content = export_user_data(current_user.id, current_user.username, db.info.get("use_primary", False))
+    return StreamingResponse(
+        content,
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{current_user.username}-export.ndjson"'},
+    )
+
+
+# 从NDJSON导入对话和消息
+@app.post("/api/users/me/import")
+async def import_my_data(request: Request, current_user=Depends(get_current_active_user)):
+    """
+    读取导出接口生成的NDJSON，按批插入到当前用户名下，每批一个事务；
+    出错时已提交的批次保留，返回出错的行号
+    """
+    importer = UserDataImporter(current_user.id)
+    try:
+        async for line_number, record in iter_ndjson(request.stream()):
+            importer.add(record, line_number)
+            if importer.full:
+                await run_in_threadpool(importer.flush)
+        await run_in_threadpool(importer.flush)
+    except ImportFormatError as e:
+        raise HTTPException(status_code=400, detail={"error": str(e), "line": e.line_number, **importer.summary()})
+    finally:
+        if importer.conversations:
+            mark_user_write(current_user.id)
+    return importer.summary()
+
+
 @app.post("/api/ocr/recognize", response_model=OCRResponse)
 async def ocr_recognize(request: OCRRequest, current_user=Depends(get_current_active_user)):
     """
@@ -267,12 +469,20 @@ async def ocr_recognize(request: OCRRequest, current_user=Depends(get_current_ac
     支持通过base64编码的图片识别数学试题内容，
     返回结构化的文本识别结果，包括公式的Latex格式输出。
     """
+    # OCR服务按需加载，不影响应用启动
+    from app.ocr_service import get_ocr_service
+
+    charge_request(current_user.id, "ocr")
     try:
         ocr_service = get_ocr_service()
         result = await ocr_service.recognize_math_paper(
             image_base64=request.image_base64,
             config=request.config
         )
+        if result.success:
+            tracker = get_usage_tracker()
+            if tracker is not None:
+                tracker.record(current_user.id, "ocr", ocr_pages=1)
         return result
         
     except ValueError as e:
@@ -292,6 +502,8 @@ async def ocr_test():
     """
     OCR服务测试接口，检查服务配置是否正确
     """
+    from app.ocr_service import get_ocr_service
+
     try:
         get_ocr_service()
         return {"success": True, "message": "OCR服务配置正常"}
@@ -305,3 +517,27 @@ async def health_check():
     API服务健康检查接口
     """
     return {"status": "ok"}
+
+
+@app.get("/ready")
+async def readiness_check():
+    """
+    就绪检查接口，数据库和上游连接池预热完成且未在停机时返回200
+    """
+    if not state.draining:
+        await warm_up()
+    body = {
+        "status": "ready" if state.ready else ("draining" if state.draining else "starting"),
+        "database": state.db_ready,
+        "upstream": state.upstream_ready,
+        "active_streams": state.active_streams,
+        "import_seconds": state.import_seconds,
+        "startup_seconds": state.startup_seconds,
+        "db_pools": pool_stats(),
+    }
+    if not state.ready:
+        return JSONResponse(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, content=body)
+    return body
+
+
+state.import_seconds = time.perf_counter() - _import_started
@@ -1,6 +1,6 @@
 from pydantic import BaseModel, EmailStr, Field
-from typing import List, Optional
-from datetime import datetime
+from typing import Dict, List, Optional
+from datetime import date, datetime
 
 
 # 用户相关模型
@@ -81,6 +81,46 @@ class LLMResponse(BaseModel):
     answer: str = ""
 
 
+# 检索相关模型
+class SearchHit(BaseModel):
+    conversation_id: int
+    conversation_title: str
+    message_id: Optional[int] = None  # 为空表示命中的是对话标题
+    is_user: Optional[bool] = None
+    created_at: Optional[datetime] = None
+    snippet: str
+    score: float
+
+
+class SearchResponse(BaseModel):
+    total: int
+    page: int
+    page_size: int
+    items: List[SearchHit] = Field(default_factory=list)
+
+
+# 用量相关模型
+class UsageCounters(BaseModel):
+    requests: int = 0
+    events: int = 0
+    answer_chars: int = 0
+    ocr_pages: int = 0
+    generation_seconds: float = 0.0
+
+
+class UsageDay(UsageCounters):
+    day: date
+    model: str
+
+
+class UsageResponse(BaseModel):
+    since: datetime
+    days: List[UsageDay] = Field(default_factory=list)
+    totals: Dict[str, UsageCounters] = Field(default_factory=dict)  # 按模型合计
+    today: UsageCounters
+    limits: Dict[str, int] = Field(default_factory=dict)  # 每日配额，未设置的不列出
+
+
 # Token相关模型
 class Token(BaseModel):
     access_token: str
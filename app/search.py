@@ -0,0 +1,324 @@
+"""
+对话历史全文检索
+
+消息内容和对话标题经过自定义分词后写入 search_documents 表:
+Postgres 使用 tsvector + GIN 索引，SQLite 使用 FTS5 虚拟表(本地测试)。
+分词规则: 英文单词和数字转小写，LaTeX命令去掉反斜杠(\\int -> int)，
+中文按单字和相邻两字切分，查询时中文按两字切分，从而支持任意长度的中文子串检索。
+超过 MAX_TOKEN_CHARS 的英文单词/数字(如程序输出的大整数)不建索引。
+"""
+import html
+import re
+from typing import Iterable, List, Sequence, Tuple
+
+from sqlalchemy import event, inspect, text
+from sqlalchemy.orm import Session
+
+from app.models import Conversation, Message
+
+SUPPORTED_DIALECTS = ("postgresql", "sqlite")
+
+# 摘要长度(字符数)
+SNIPPET_CHARS = 120
+
+# 英文单词、数字和LaTeX命令的最大长度，更长的不建索引(Postgres 拒绝超过2047字节的词)
+MAX_TOKEN_CHARS = 64
+
+# LaTeX命令 | 英文单词或数字 | 连续的中日韩文字
+TOKEN_PATTERN = re.compile(r"\\([A-Za-z]+)|([A-Za-z0-9]+)|([\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]+)")
+
+
+def tokenize(content: str) -> List[str]:
+    """
+    将文本切分为索引词，保留重复以便计算词频
+    """
+    tokens = []
+    for command, word, cjk in TOKEN_PATTERN.findall(content or ""):
+        if len(command or word) > MAX_TOKEN_CHARS:
+            continue
+        if command:
+            tokens.append(command.lower())
+        elif word:
+            tokens.append(word.lower())
+        else:
+            tokens.extend(cjk)
+            tokens.extend(cjk[i:i + 2] for i in range(len(cjk) - 1))
+    return tokens
+
+
+def query_terms(query: str) -> List[str]:
+    """
+    将查询切分为检索词，所有词都需命中
+    """
+    terms = []
+    for command, word, cjk in TOKEN_PATTERN.findall(query or ""):
+        if len(command or word) > MAX_TOKEN_CHARS:
+            continue
+        if command:
+            terms.append(command.lower())
+        elif word:
+            terms.append(word.lower())
+        elif len(cjk) == 1:
+            terms.append(cjk)
+        else:
+            terms.extend(cjk[i:i + 2] for i in range(len(cjk) - 1))
+    return list(dict.fromkeys(terms))
+
+
+def _tsvector_literal(tokens: Sequence[str]) -> str:
+    # 直接构造tsvector文本，绕过数据库的分词器；词中只含字母、数字和汉字，无需转义
+    positions = {}
+    for position, token in enumerate(tokens[:16383], start=1):
+        positions.setdefault(token, []).append(str(position))
+    return " ".join(f"'{token}':{','.join(items[:256])}" for token, items in positions.items())
+
+
+def _document_terms(dialect: str, content: str) -> str:
+    tokens = tokenize(content)
+    if dialect == "postgresql":
+        return _tsvector_literal(tokens)
+    return " ".join(tokens)
+
+
+def _terms_param(dialect: str) -> str:
+    return "CAST(:terms AS tsvector)" if dialect == "postgresql" else ":terms"
+
+
+def ensure_search_index(connection):
+    """
+    创建检索表和索引（已存在时跳过）
+    """
+    dialect = connection.dialect.name
+    if dialect == "postgresql":
+        connection.execute(text(
+            "CREATE TABLE IF NOT EXISTS search_documents ("
+            "id BIGSERIAL PRIMARY KEY, "
+            "user_id INTEGER NOT NULL, "
+            "conversation_id INTEGER NOT NULL, "
+            "message_id INTEGER, "
+            "terms TSVECTOR NOT NULL)"
+        ))
+        connection.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_search_documents_terms ON search_documents USING GIN (terms)"
+        ))
+        connection.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_search_documents_user_id ON search_documents (user_id)"
+        ))
+        connection.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_search_documents_conversation_id ON search_documents (conversation_id)"
+        ))
+    elif dialect == "sqlite":
+        connection.execute(text(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS search_documents USING fts5("
+            "terms, user_id UNINDEXED, conversation_id UNINDEXED, message_id UNINDEXED, "
+            "tokenize = 'unicode61 remove_diacritics 0')"
+        ))
+
+
+def index_messages(connection, messages: Iterable[Tuple[int, int, str]]):
+    """
+    为新消息建立索引，messages 为 (message_id, conversation_id, content)
+    """
+    dialect = connection.dialect.name
+    if dialect not in SUPPORTED_DIALECTS:
+        return
+    params = [
+        {"message_id": message_id, "conversation_id": conversation_id, "terms": _document_terms(dialect, content)}
+        for message_id, conversation_id, content in messages
+    ]
+    if not params:
+        return
+    connection.execute(text(
+        "INSERT INTO search_documents (terms, user_id, conversation_id, message_id) "
+        f"SELECT {_terms_param(dialect)}, user_id, id, :message_id FROM conversations WHERE id = :conversation_id"
+    ), params)
+
+
+def index_conversations(connection, conversations: Iterable[Tuple[int, str]]):
+    """
+    为对话标题建立索引，conversations 为 (conversation_id, title)
+    """
+    dialect = connection.dialect.name
+    if dialect not in SUPPORTED_DIALECTS:
+        return
+    params = [
+        {"conversation_id": conversation_id, "terms": _document_terms(dialect, title)}
+        for conversation_id, title in conversations
+    ]
+    if not params:
+        return
+    connection.execute(text(
+        "INSERT INTO search_documents (terms, user_id, conversation_id, message_id) "
+        f"SELECT {_terms_param(dialect)}, user_id, id, NULL FROM conversations WHERE id = :conversation_id"
+    ), params)
+
+
+def index_conversation_title(connection, conversation_id: int, title: str, replace: bool = False):
+    """
+    为单个对话标题建立索引，replace 为真时先删除旧标题
+    """
+    if connection.dialect.name not in SUPPORTED_DIALECTS:
+        return
+    if replace:
+        connection.execute(text(
+            "DELETE FROM search_documents WHERE conversation_id = :conversation_id AND message_id IS NULL"
+        ), {"conversation_id": conversation_id})
+    index_conversations(connection, [(conversation_id, title)])
+
+
+@event.listens_for(Message, "after_insert")
+def _index_new_message(mapper, connection, target):
+    index_messages(connection, [(target.id, target.conversation_id, target.content)])
+
+
+@event.listens_for(Conversation, "after_insert")
+def _index_new_conversation(mapper, connection, target):
+    index_conversation_title(connection, target.id, target.title)
+
+
+@event.listens_for(Conversation, "after_update")
+def _reindex_conversation_title(mapper, connection, target):
+    if inspect(target).attrs.title.history.has_changes():
+        index_conversation_title(connection, target.id, target.title, replace=True)
+
+
+def rebuild_search_index(engine, batch_size: int = 1000):
+    """
+    清空并按批重建检索索引，用于首次上线或修复
+    """
+    with engine.begin() as connection:
+        ensure_search_index(connection)
+        connection.execute(text("DELETE FROM search_documents"))
+
+    last_id = 0
+    while True:
+        with engine.begin() as connection:
+            rows = connection.execute(
+                Conversation.__table__.select()
+                .with_only_columns(Conversation.id, Conversation.title)
+                .where(Conversation.id > last_id).order_by(Conversation.id).limit(batch_size)
+            ).all()
+            index_conversations(connection, rows)
+        if len(rows) < batch_size:
+            break
+        last_id = rows[-1][0]
+
+    last_id = 0
+    while True:
+        with engine.begin() as connection:
+            rows = connection.execute(
+                Message.__table__.select()
+                .with_only_columns(Message.id, Message.conversation_id, Message.content)
+                .where(Message.id > last_id).order_by(Message.id).limit(batch_size)
+            ).all()
+            index_messages(connection, rows)
+        if len(rows) < batch_size:
+            break
+        last_id = rows[-1][0]
+
+
+def highlight(content: str, terms: List[str], length: int = SNIPPET_CHARS) -> str:
+    """
+    截取第一个命中位置附近的片段，并用<mark>标出命中的词
+    """
+    content = content or ""
+    # 长词优先，避免短词截断长词的高亮
+    alternatives = "|".join(re.escape(term) for term in sorted(terms, key=len, reverse=True))
+    pattern = re.compile(alternatives or "(?!)", re.IGNORECASE)
+    match = pattern.search(content)
+    start = max(0, match.start() - length // 3) if match else 0
+    end = min(len(content), start + length)
+    window = content[start:end]
+
+    parts = []
+    position = 0
+    for found in pattern.finditer(window):
+        parts.append(html.escape(window[position:found.start()]))
+        parts.append(f"<mark>{html.escape(found.group())}</mark>")
+        position = found.end()
+    parts.append(html.escape(window[position:]))
+
+    snippet = "".join(parts)
+    if start > 0:
+        snippet = "…" + snippet
+    if end < len(content):
+        snippet += "…"
+    return snippet
+
+
+def _phrases(query: str) -> List[str]:
+    # 高亮优先匹配查询中的原始词组
+    return [command or word or cjk for command, word, cjk in TOKEN_PATTERN.findall(query or "")]
+
+
+def _snippet(content: str, phrases: List[str], terms: List[str]) -> str:
+    if any(phrase.lower() in (content or "").lower() for phrase in phrases):
+        return highlight(content, phrases)
+    return highlight(content, terms)
+
+
+def search(db: Session, user_id: int, query: str, page: int = 1, page_size: int = 20):
+    """
+    检索当前用户的消息与对话标题，按相关度排序，返回 (总数, 结果列表)
+    """
+    terms = query_terms(query)
+    dialect = db.get_bind().dialect.name
+    if not terms:
+        return 0, []
+    if dialect not in SUPPORTED_DIALECTS:
+        raise NotImplementedError(f"数据库 {dialect} 不支持全文检索")
+
+    offset = (page - 1) * page_size
+    if dialect == "postgresql":
+        params = {"user_id": user_id, "query": " & ".join(f"'{term}'" for term in terms),
+                  "limit": page_size, "offset": offset}
+        total = db.execute(text(
+            "SELECT count(*) FROM search_documents "
+            "WHERE user_id = :user_id AND terms @@ CAST(:query AS tsquery)"
+        ), params).scalar()
+        rows = db.execute(text(
+            "SELECT conversation_id, message_id, ts_rank(terms, CAST(:query AS tsquery)) AS score "
+            "FROM search_documents WHERE user_id = :user_id AND terms @@ CAST(:query AS tsquery) "
+            "ORDER BY score DESC, id DESC LIMIT :limit OFFSET :offset"
+        ), params).all()
+    else:
+        params = {"user_id": user_id, "query": " ".join(f'"{term}"' for term in terms),
+                  "limit": page_size, "offset": offset}
+        total = db.execute(text(
+            "SELECT count(*) FROM search_documents "
+            "WHERE search_documents MATCH :query AND user_id = :user_id"
+        ), params).scalar()
+        rows = db.execute(text(
+            "SELECT conversation_id, message_id, -bm25(search_documents) AS score "
+            "FROM search_documents WHERE search_documents MATCH :query AND user_id = :user_id "
+            "ORDER BY score DESC, rowid DESC LIMIT :limit OFFSET :offset"
+        ), params).all()
+
+    conversation_ids = {row.conversation_id for row in rows}
+    message_ids = [row.message_id for row in rows if row.message_id is not None]
+    titles = dict(db.query(Conversation.id, Conversation.title).filter(
+        Conversation.id.in_(conversation_ids), Conversation.user_id == user_id).all()) if conversation_ids else {}
+    messages = {
+        row.id: row for row in db.query(Message.id, Message.content, Message.is_user, Message.created_at)
+        .filter(Message.id.in_(message_ids)).all()
+    } if message_ids else {}
+
+    phrases = _phrases(query)
+    items = []
+    for row in rows:
+        if row.conversation_id not in titles:
+            continue
+        title = titles[row.conversation_id]
+        message = messages.get(row.message_id) if row.message_id is not None else None
+        if row.message_id is not None and message is None:
+            continue
+        items.append({
+            "conversation_id": row.conversation_id,
+            "conversation_title": title,
+            "message_id": row.message_id,
+            "is_user": message.is_user if message else None,
+            "created_at": message.created_at if message else None,
+            "snippet": _snippet(message.content if message else title, phrases, terms),
+            "score": float(row.score),
+        })
+    return total, items
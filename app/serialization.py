@@ -0,0 +1,46 @@
+import json
+from datetime import date, datetime
+from typing import Any, Union
+
+from fastapi.responses import JSONResponse
+
+# 安装了orjson时使用，否则退回标准库json
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+
+def _default(obj: Any):
+    """标准库json无法直接序列化的类型"""
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps_bytes(obj: Any) -> bytes:
+    """序列化为UTF-8编码的紧凑JSON"""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"), default=_default).encode("utf-8")
+
+
+def dumps(obj: Any) -> str:
+    """序列化为紧凑JSON字符串"""
+    if orjson is not None:
+        return orjson.dumps(obj).decode("utf-8")
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"), default=_default)
+
+
+def loads(data: Union[str, bytes]) -> Any:
+    """解析JSON，格式错误时抛出 json.JSONDecodeError"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class FastJSONResponse(JSONResponse):
+    """使用上面序列化函数的JSON响应"""
+
+    def render(self, content: Any) -> bytes:
+        return dumps_bytes(content)
@@ -0,0 +1,211 @@
+"""
+对话数据的批量导出与导入(NDJSON，每行一个JSON对象)
+
+导出格式:
+    {"type": "export", "version": 1, "username": ..., "exported_at": ...}
+    {"type": "conversation", "id": ..., "title": ..., "created_at": ..., "updated_at": ...}
+    {"type": "message", "id": ..., "conversation_id": ..., "is_user": ..., "content": ..., "created_at": ...}
+    ...
+每个对话之后紧跟它的全部消息。导入时按原始对话ID关联消息，并为当前用户生成新ID。
+"""
+import os
+from datetime import datetime
+from typing import AsyncIterator, Dict, Iterator, List, Optional
+
+from sqlalchemy import insert, select
+
+from app.database import ReadSessionLocal, engine
+from app.models import Conversation, Message
+from app.search import index_conversations, index_messages
+from app.serialization import dumps_bytes, loads
+
+# 服务端游标每次取回的行数
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+
+# 导入时每个事务写入的记录数(对话+消息)
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "2000"))
+
+EXPORT_VERSION = 1
+
+
+class ImportFormatError(ValueError):
+    """导入文件格式错误"""
+
+    def __init__(self, line_number: int, message: str):
+        super().__init__(f"第 {line_number} 行: {message}")
+        self.line_number = line_number
+
+
+def export_user_data(user_id: int, username: str, use_primary: bool = False) -> Iterator[bytes]:
+    """
+    以服务端游标分批读取用户的对话和消息，逐批生成NDJSON
+    """
+    db = ReadSessionLocal()
+    db.info["use_primary"] = use_primary
+    try:
+        yield dumps_bytes({
+            "type": "export",
+            "version": EXPORT_VERSION,
+            "username": username,
+            "exported_at": datetime.utcnow(),
+        }) + b"\n"
+
+        stmt = (
+            select(
+                Conversation.id, Conversation.title, Conversation.created_at, Conversation.updated_at,
+                Message.id.label("message_id"), Message.is_user, Message.content,
+                Message.created_at.label("message_created_at"),
+            )
+            .outerjoin(Message, Message.conversation_id == Conversation.id)
+            .where(Conversation.user_id == user_id)
+            .order_by(Conversation.id, Message.id)
+            .execution_options(stream_results=True, yield_per=EXPORT_BATCH_SIZE)
+        )
+        current_conversation = None
+        for partition in db.execute(stmt).partitions():
+            lines = []
+            for row in partition:
+                if row.id != current_conversation:
+                    current_conversation = row.id
+                    lines.append(dumps_bytes({
+                        "type": "conversation",
+                        "id": row.id,
+                        "title": row.title,
+                        "created_at": row.created_at,
+                        "updated_at": row.updated_at,
+                    }))
+                if row.message_id is not None:
+                    lines.append(dumps_bytes({
+                        "type": "message",
+                        "id": row.message_id,
+                        "conversation_id": row.id,
+                        "is_user": row.is_user,
+                        "content": row.content,
+                        "created_at": row.message_created_at,
+                    }))
+            yield b"\n".join(lines) + b"\n"
+    finally:
+        db.close()
+
+
+def _parse_datetime(value: Optional[str]) -> datetime:
+    return datetime.fromisoformat(value) if value else datetime.utcnow()
+
+
+class UserDataImporter:
+    """
+    将NDJSON记录按批写入数据库，每批一个事务
+    """
+
+    def __init__(self, user_id: int, batch_size: int = IMPORT_BATCH_SIZE):
+        self.user_id = user_id
+        self.batch_size = batch_size
+        self.conversation_ids: Dict[int, int] = {}  # 原始对话ID -> 新ID
+        self.pending_conversations: List[dict] = []
+        self.pending_messages: List[dict] = []
+        self.conversations = 0
+        self.messages = 0
+        self.skipped = 0
+
+    @property
+    def full(self) -> bool:
+        return len(self.pending_messages) + len(self.pending_conversations) >= self.batch_size
+
+    def add(self, record: dict, line_number: int):
+        try:
+            kind = record.get("type")
+            if kind == "conversation":
+                self.pending_conversations.append({
+                    "source_id": int(record["id"]),
+                    "title": str(record.get("title") or "新对话"),
+                    "created_at": _parse_datetime(record.get("created_at")),
+                    "updated_at": _parse_datetime(record.get("updated_at")),
+                })
+            elif kind == "message":
+                is_user = record.get("is_user", True)
+                if not isinstance(is_user, bool):
+                    raise ImportFormatError(line_number, f"字段错误: is_user 必须是 true 或 false，而不是 {is_user!r}")
+                self.pending_messages.append({
+                    "source_conversation_id": int(record["conversation_id"]),
+                    "is_user": is_user,
+                    "content": str(record.get("content") or ""),
+                    "created_at": _parse_datetime(record.get("created_at")),
+                })
+            elif kind != "export":
+                raise ImportFormatError(line_number, f"未知的记录类型 {kind!r}")
+        except (KeyError, TypeError, ValueError) as e:
+            if isinstance(e, ImportFormatError):
+                raise
+            raise ImportFormatError(line_number, f"字段错误: {e}")
+
+    def flush(self):
+        """
+        在一个事务中写入当前批次，对话先于消息写入以便关联新ID
+        """
+        if not self.pending_conversations and not self.pending_messages:
+            return
+        with engine.begin() as connection:
+            if self.pending_conversations:
+                params = [
+                    {"user_id": self.user_id, "title": item["title"],
+                     "created_at": item["created_at"], "updated_at": item["updated_at"]}
+                    for item in self.pending_conversations
+                ]
+                new_ids = connection.execute(
+                    insert(Conversation).returning(Conversation.id, sort_by_parameter_order=True), params
+                ).scalars().all()
+                for item, new_id in zip(self.pending_conversations, new_ids):
+                    self.conversation_ids[item["source_id"]] = new_id
+                index_conversations(connection, zip(new_ids, (item["title"] for item in self.pending_conversations)))
+                self.conversations += len(new_ids)
+
+            params = []
+            for item in self.pending_messages:
+                conversation_id = self.conversation_ids.get(item["source_conversation_id"])
+                if conversation_id is None:
+                    self.skipped += 1
+                    continue
+                params.append({"conversation_id": conversation_id, "is_user": item["is_user"],
+                               "content": item["content"], "created_at": item["created_at"]})
+            if params:
+                new_ids = connection.execute(
+                    insert(Message).returning(Message.id, sort_by_parameter_order=True), params
+                ).scalars().all()
+                index_messages(connection, (
+                    (new_id, item["conversation_id"], item["content"]) for new_id, item in zip(new_ids, params)
+                ))
+                self.messages += len(new_ids)
+
+        self.pending_conversations = []
+        self.pending_messages = []
+
+    def summary(self) -> dict:
+        return {"conversations": self.conversations, "messages": self.messages, "skipped": self.skipped}
+
+
+async def iter_ndjson(chunks: AsyncIterator[bytes]) -> AsyncIterator[tuple]:
+    """
+    将分块到达的请求体拆成逐行的JSON对象，返回 (行号, 对象)
+    """
+    buffer = b""
+    line_number = 0
+    async for chunk in chunks:
+        buffer += chunk
+        lines = buffer.split(b"\n")
+        buffer = lines.pop()
+        for line in lines:
+            line_number += 1
+            if line.strip():
+                yield line_number, _parse_line(line, line_number)
+    if buffer.strip():
+        yield line_number + 1, _parse_line(buffer, line_number + 1)
+
+
+def _parse_line(line: bytes, line_number: int) -> dict:
+    try:
+        record = loads(line)
+    except ValueError as e:
+        raise ImportFormatError(line_number, f"JSON解析错误: {e}")
+    if not isinstance(record, dict):
+        raise ImportFormatError(line_number, "每行必须是一个JSON对象")
+    return record
@@ -0,0 +1,382 @@
+"""
+按用户、按模型的用量统计与配额
+
+每次请求只在内存中累加计数，按 (用户, 模型, 时间桶) 聚合，由后台线程每隔
+USAGE_FLUSH_SECONDS 秒把增量合并写入 usage_rollups 表(ON CONFLICT 累加)。
+配额检查使用缓存的当日用量: 数据库中的当日合计(定期刷新) + 本进程尚未写入的增量。
+"""
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import AsyncGenerator, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException, status
+from sqlalchemy import func, select, update
+from sqlalchemy.orm import Session
+
+from app.database import engine
+from app.models import UsageRollup
+from app.serialization import loads
+
+logger = logging.getLogger(__name__)
+
+USAGE_ENABLED = os.getenv("USAGE_ENABLED", "1").lower() in ("1", "true", "yes", "on")
+
+# 聚合的时间粒度(秒)，应能整除一天
+USAGE_BUCKET_SECONDS = int(os.getenv("USAGE_BUCKET_SECONDS", "3600"))
+
+# 写入数据库的间隔(秒)
+USAGE_FLUSH_SECONDS = float(os.getenv("USAGE_FLUSH_SECONDS", "10"))
+
+# 配额检查时，从数据库刷新当日用量的间隔(秒)；多进程部署时其他进程的用量在该时间内可见
+USAGE_QUOTA_REFRESH_SECONDS = float(os.getenv("USAGE_QUOTA_REFRESH_SECONDS", "60"))
+
+# 每个用户每天(UTC)的配额，0表示不限
+DAILY_LIMITS = {
+    "requests": int(os.getenv("USAGE_DAILY_REQUESTS", "0")),
+    "answer_chars": int(os.getenv("USAGE_DAILY_ANSWER_CHARS", "0")),
+    "ocr_pages": int(os.getenv("USAGE_DAILY_OCR_PAGES", "0")),
+}
+
+FIELDS = ("requests", "events", "answer_chars", "ocr_pages", "generation_seconds")
+
+MODELS = ("tir", "cot", "tot", "ocr")
+
+LIMIT_NAMES = {"requests": "请求次数", "answer_chars": "回答字数", "ocr_pages": "OCR页数"}
+
+
+def usage_model(model: str) -> str:
+    """请求中的模型名对应的统计类别，非tir/tot的对话模型都由COT服务处理"""
+    return model if model in MODELS else "cot"
+
+
+def bucket_start(moment: datetime, seconds: int = USAGE_BUCKET_SECONDS) -> datetime:
+    """所在时间桶的起始时间"""
+    day = moment.replace(hour=0, minute=0, second=0, microsecond=0)
+    offset = int((moment - day).total_seconds()) // seconds * seconds
+    return day + timedelta(seconds=offset)
+
+
+def empty_counters() -> Dict[str, float]:
+    return {field: 0 for field in FIELDS}
+
+
+def _add(target: Dict[str, float], counts: Dict[str, float], sign: int = 1):
+    for field, value in counts.items():
+        target[field] += sign * value
+
+
+class DailyUsage:
+    """某个用户当日的用量缓存"""
+
+    __slots__ = ("day", "stored", "unflushed", "loaded_at")
+
+    def __init__(self, day: datetime):
+        self.day = day
+        self.stored = None          # 数据库中的合计(含本进程已写入的部分)，未加载时为None
+        self.unflushed = empty_counters()  # 本进程尚未写入的部分
+        self.loaded_at = 0.0               # 加载 stored 的查询开始的时间(time.monotonic)
+
+
+class UsageTracker:
+    """
+    进程内的用量聚合器
+    """
+
+    def __init__(self, flush_seconds: float = USAGE_FLUSH_SECONDS):
+        self.flush_seconds = flush_seconds
+        self._lock = threading.Lock()
+        self._pending: Dict[Tuple[int, str, datetime], Dict[str, float]] = {}
+        self._daily: Dict[int, DailyUsage] = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    # ---- 计数 ----
+
+    def record(self, user_id: int, model: str, **counts):
+        """
+        累加用量，counts 为 FIELDS 中的字段
+        """
+        now = datetime.utcnow()
+        key = (user_id, model, bucket_start(now))
+        today = bucket_start(now, 86400)
+        with self._lock:
+            pending = self._pending.get(key)
+            if pending is None:
+                pending = self._pending[key] = empty_counters()
+            _add(pending, counts)
+            daily = self._daily_for(user_id, today)
+            _add(daily.unflushed, counts)
+
+    def _daily_for(self, user_id: int, today: datetime) -> DailyUsage:
+        daily = self._daily.get(user_id)
+        if daily is None or daily.day != today:
+            daily = self._daily[user_id] = DailyUsage(today)
+        return daily
+
+    # ---- 配额 ----
+
+    def used_today(self, user_id: int) -> Dict[str, float]:
+        """
+        用户当日的用量，缓存过期时查询一次数据库
+        """
+        today = bucket_start(datetime.utcnow(), 86400)
+        with self._lock:
+            daily = self._daily_for(user_id, today)
+            fresh = daily.stored is not None and time.monotonic() - daily.loaded_at < USAGE_QUOTA_REFRESH_SECONDS
+            if fresh:
+                used = dict(daily.stored)
+                _add(used, daily.unflushed)
+                return used
+
+        query_started = time.monotonic()
+        stored = load_usage_totals(user_id, today)
+        with self._lock:
+            daily = self._daily_for(user_id, today)
+            # 并发加载时保留较晚开始的查询结果
+            if query_started >= daily.loaded_at:
+                daily.stored = stored
+                daily.loaded_at = query_started
+            used = dict(daily.stored if daily.stored is not None else stored)
+            _add(used, daily.unflushed)
+        return used
+
+    def check_quota(self, user_id: int, model: str):
+        """
+        当日用量达到配额时抛出429
+        """
+        limits = {name: limit for name, limit in DAILY_LIMITS.items() if limit > 0}
+        if model != "ocr":
+            limits.pop("ocr_pages", None)
+        if not limits:
+            return
+        used = self.used_today(user_id)
+        for name, limit in limits.items():
+            if used[name] >= limit:
+                now = datetime.utcnow()
+                retry_after = int((bucket_start(now, 86400) + timedelta(days=1) - now).total_seconds()) + 1
+                raise HTTPException(
+                    status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                    detail=f"今日{LIMIT_NAMES[name]}已达上限 {limit}",
+                    headers={"Retry-After": str(retry_after)},
+                )
+
+    # ---- 查询 ----
+
+    def unflushed_for(self, user_id: int) -> List[Tuple[str, datetime, Dict[str, float]]]:
+        """
+        本进程中该用户尚未写入的用量 (模型, 时间桶, 计数)
+        """
+        with self._lock:
+            return [(model, start, dict(counts)) for (owner, model, start), counts in self._pending.items()
+                    if owner == user_id]
+
+    # ---- 写入 ----
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="usage-flush", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """
+        停止后台线程并写入剩余用量
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def _run(self):
+        while not self._stop.wait(self.flush_seconds):
+            self.flush()
+
+    def flush(self) -> bool:
+        """
+        把累计的增量合并写入数据库，失败时放回内存下次重试
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return True
+
+        write_started = time.monotonic()
+        try:
+            write_rollups(pending)
+        except Exception:
+            logger.exception("写入用量失败，%d 条增量稍后重试", len(pending))
+            with self._lock:
+                for key, counts in pending.items():
+                    merged = self._pending.setdefault(key, empty_counters())
+                    _add(merged, counts)
+            return False
+
+        write_finished = time.monotonic()
+
+        # 已写入的部分从“未写入”移到“数据库合计”
+        with self._lock:
+            for (user_id, model, start), counts in pending.items():
+                daily = self._daily.get(user_id)
+                if daily is None or bucket_start(start, 86400) != daily.day:
+                    continue
+                _add(daily.unflushed, counts, -1)
+                if daily.stored is None or daily.loaded_at >= write_finished:
+                    continue  # 写入完成后加载的合计已包含本批
+                if daily.loaded_at < write_started:
+                    _add(daily.stored, counts)
+                else:
+                    # 加载与写入同时进行，无法确定是否已包含本批，只接受写入完成后开始的重新加载
+                    daily.stored = None
+                    daily.loaded_at = write_finished
+        return True
+
+
+def write_rollups(pending: Dict[Tuple[int, str, datetime], Dict[str, float]]):
+    """
+    在一个事务中把增量累加到 usage_rollups，Postgres/SQLite 使用 ON CONFLICT DO UPDATE
+    """
+    table = UsageRollup.__table__
+    rows = [{"user_id": user_id, "model": model, "bucket_start": start, **counts}
+            for (user_id, model, start), counts in pending.items()]
+    with engine.begin() as connection:
+        dialect = connection.dialect.name
+        if dialect in ("postgresql", "sqlite"):
+            if dialect == "postgresql":
+                from sqlalchemy.dialects.postgresql import insert
+            else:
+                from sqlalchemy.dialects.sqlite import insert
+            stmt = insert(table)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[table.c.user_id, table.c.model, table.c.bucket_start],
+                set_={field: table.c[field] + stmt.excluded[field] for field in FIELDS},
+            )
+            connection.execute(stmt, rows)
+            return
+
+        # 其他数据库逐行先更新，不存在时插入
+        for row in rows:
+            result = connection.execute(
+                update(table)
+                .where(table.c.user_id == row["user_id"], table.c.model == row["model"],
+                       table.c.bucket_start == row["bucket_start"])
+                .values({field: table.c[field] + row[field] for field in FIELDS})
+            )
+            if result.rowcount == 0:
+                connection.execute(table.insert(), row)
+
+
+def load_usage_totals(user_id: int, since: datetime) -> Dict[str, float]:
+    """
+    数据库中用户自 since 起各项用量的合计
+    """
+    table = UsageRollup.__table__
+    with engine.connect() as connection:
+        row = connection.execute(
+            select(*(func.coalesce(func.sum(table.c[field]), 0) for field in FIELDS))
+            .where(table.c.user_id == user_id, table.c.bucket_start >= since)
+        ).one()
+    return dict(zip(FIELDS, row))
+
+
+def charge_request(user_id: int, model: str):
+    """
+    检查配额并记一次请求，超出配额时抛出429
+    """
+    tracker = get_usage_tracker()
+    if tracker is None:
+        return
+    model = usage_model(model)
+    tracker.check_quota(user_id, model)
+    tracker.record(user_id, model, requests=1)
+
+
+def usage_report(db: Session, user_id: int, days: int) -> dict:
+    """
+    用户最近 days 天(含今天)按天、按模型的用量，包含本进程尚未写入的部分
+    """
+    today = bucket_start(datetime.utcnow(), 86400)
+    since = today - timedelta(days=days - 1)
+    rows = db.query(UsageRollup.model, UsageRollup.bucket_start, *(getattr(UsageRollup, field) for field in FIELDS)) \
+        .filter(UsageRollup.user_id == user_id, UsageRollup.bucket_start >= since).all()
+    entries = [(row[0], row[1], dict(zip(FIELDS, row[2:]))) for row in rows]
+    tracker = get_usage_tracker()
+    if tracker is not None:
+        entries.extend(entry for entry in tracker.unflushed_for(user_id) if entry[1] >= since)
+
+    per_day: Dict[Tuple[datetime, str], Dict[str, float]] = {}
+    totals: Dict[str, Dict[str, float]] = {}
+    used_today = empty_counters()
+    for model, start, counts in entries:
+        day = bucket_start(start, 86400)
+        _add(per_day.setdefault((day, model), empty_counters()), counts)
+        _add(totals.setdefault(model, empty_counters()), counts)
+        if day == today:
+            _add(used_today, counts)
+
+    return {
+        "since": since,
+        "days": [{"day": day.date(), "model": model, **counts}
+                 for (day, model), counts in sorted(per_day.items())],
+        "totals": totals,
+        "today": used_today,
+        "limits": {name: limit for name, limit in DAILY_LIMITS.items() if limit > 0},
+    }
+
+
+async def meter_stream(generator: AsyncGenerator[str, None], user_id: int, model: str) -> AsyncGenerator[str, None]:
+    """
+    统计SSE回答的事件数、回答字数和生成耗时，流结束(含中断)时记一次
+    """
+    started = time.perf_counter()
+    events = 0
+    chars = 0
+    buffer = ""
+    try:
+        async for chunk in generator:
+            buffer += chunk
+            *frames, buffer = buffer.split("\n\n")
+            for frame in frames:
+                if not frame.startswith("data:"):
+                    continue
+                # 只有能解析出JSON的帧才算一个事件，上游流结束时的空块会被包成空的 data: 帧
+                try:
+                    payload = loads(frame[5:])
+                except ValueError:
+                    continue
+                events += 1
+                answer = payload.get("answer") if isinstance(payload, dict) else None
+                if isinstance(answer, str):
+                    chars += len(answer)
+            yield chunk
+    finally:
+        tracker = get_usage_tracker()
+        if tracker is not None:
+            tracker.record(user_id, usage_model(model), events=events, answer_chars=chars,
+                           generation_seconds=time.perf_counter() - started)
+
+
+_usage_tracker: Optional[UsageTracker] = None
+
+
+def get_usage_tracker() -> Optional[UsageTracker]:
+    """
+    获取用量统计单例，USAGE_ENABLED=0 时返回None
+    """
+    global _usage_tracker
+    if _usage_tracker is None and USAGE_ENABLED:
+        _usage_tracker = UsageTracker()
+        _usage_tracker.start()
+    return _usage_tracker
+
+
+def stop_usage_tracker():
+    """
+    应用停止时写入剩余用量
+    """
+    global _usage_tracker
+    if _usage_tracker is not None:
+        _usage_tracker.stop()
+        _usage_tracker = None
@@ -0,0 +1,356 @@
+"""
+消息写入与对话更新的延迟批量提交(write-behind)
+
+开启后(WRITE_BEHIND_ENABLED=1)，新消息和对话的 updated_at/标题 先进入进程内缓冲，
+由后台线程每隔 WRITE_BEHIND_FLUSH_MS 毫秒或攒够 WRITE_BEHIND_MAX_BATCH 条时在一个事务中批量写入:
+消息用多行 INSERT ... RETURNING，同一对话的多次更新合并为一次 UPDATE。
+新消息接口在开始回答前、保存回答接口在返回前都会等待消息写入，因此消息对所有工作进程可见；
+对话的更新时间和标题在写入前只对本进程的读请求可见(见 pending_messages / pending_conversation)。
+应用停止时会写完缓冲中的全部数据。
+"""
+import asyncio
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from sqlalchemy import bindparam, insert, update
+from sqlalchemy.exc import DBAPIError, DisconnectionError
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+
+from app.database import engine, mark_user_write
+from app.models import Conversation, Message
+from app.search import index_conversation_title, index_messages
+
+logger = logging.getLogger(__name__)
+
+WRITE_BEHIND_ENABLED = os.getenv("WRITE_BEHIND_ENABLED", "0").lower() in ("1", "true", "yes", "on")
+
+# 两次批量写入的最长间隔(毫秒)
+WRITE_BEHIND_FLUSH_MS = float(os.getenv("WRITE_BEHIND_FLUSH_MS", "20"))
+
+# 缓冲达到该条数时立即写入
+WRITE_BEHIND_MAX_BATCH = int(os.getenv("WRITE_BEHIND_MAX_BATCH", "500"))
+
+# 数据库暂时不可用时，重试前等待的秒数
+WRITE_BEHIND_RETRY_SECONDS = float(os.getenv("WRITE_BEHIND_RETRY_SECONDS", "1"))
+
+# 同一批数据连续写入失败的最多重试次数，超过后丢弃并通知等待方
+WRITE_BEHIND_MAX_RETRIES = int(os.getenv("WRITE_BEHIND_MAX_RETRIES", "5"))
+
+# 停止时写入失败的最多重试次数
+WRITE_BEHIND_STOP_RETRIES = int(os.getenv("WRITE_BEHIND_STOP_RETRIES", "3"))
+
+
+def is_transient_error(error: Exception) -> bool:
+    """
+    连接层面的暂时故障(连接断开、连接池等待超时、SQLite 数据库被锁)，稍后重试可能成功；
+    表不存在、词过长等其他数据库错误重试也不会成功
+    """
+    if isinstance(error, (PoolTimeoutError, DisconnectionError)):
+        return True
+    if not isinstance(error, DBAPIError):
+        return False
+    if error.connection_invalidated:
+        return True
+    # Postgres SQLSTATE 08xxx 为连接异常
+    sqlstate = getattr(error.orig, "pgcode", None) or getattr(error.orig, "sqlstate", None)
+    if sqlstate and str(sqlstate).startswith("08"):
+        return True
+    return "database is locked" in str(error.orig)
+
+
+class PendingMessage:
+    """尚未写入数据库的消息，写入后 id 为数据库生成的ID"""
+
+    __slots__ = ("id", "conversation_id", "user_id", "is_user", "content", "created_at", "future")
+
+    def __init__(self, conversation_id: int, user_id: int, is_user: bool, content: str, created_at: datetime):
+        self.id = None
+        self.conversation_id = conversation_id
+        self.user_id = user_id
+        self.is_user = is_user
+        self.content = content
+        self.created_at = created_at
+        self.future = Future()
+
+    def _asdict(self) -> dict:
+        return {"content": self.content, "is_user": self.is_user, "id": self.id,
+                "conversation_id": self.conversation_id, "created_at": self.created_at}
+
+
+class WriteBehindBuffer:
+    """
+    进程内的写缓冲，由一个后台线程批量写入
+    """
+
+    def __init__(self, flush_ms: float = WRITE_BEHIND_FLUSH_MS, max_batch: int = WRITE_BEHIND_MAX_BATCH):
+        self.flush_interval = flush_ms / 1000
+        self.max_batch = max_batch
+        self._condition = threading.Condition()
+        self._messages: List[PendingMessage] = []
+        self._conversations: Dict[int, dict] = {}  # 对话ID -> 待更新的字段
+        # 正在写入的批次，写入完成前仍对读请求可见
+        self._flushing_messages: List[PendingMessage] = []
+        self._flushing_conversations: Dict[int, dict] = {}
+        self._flush_requested = False
+        self._failed_attempts = 0  # 队首批次连续写入失败的次数
+        self._stopping = False
+        self._thread: Optional[threading.Thread] = None
+        self.flushes = 0
+        self.flushed_messages = 0
+
+    # ---- 写入 ----
+
+    def add_message(self, conversation_id: int, user_id: int, content: str, is_user: bool,
+                    created_at: Optional[datetime] = None) -> PendingMessage:
+        """
+        缓冲一条新消息，返回的 future 在写入后得到消息ID
+        """
+        message = PendingMessage(conversation_id, user_id, is_user, content, created_at or datetime.utcnow())
+        with self._condition:
+            if self._stopping:
+                raise RuntimeError("写缓冲已停止")
+            self._messages.append(message)
+            if len(self._messages) >= self.max_batch:
+                self._flush_requested = True
+            self._condition.notify()
+        return message
+
+    def update_conversation(self, conversation_id: int, user_id: int, updated_at: Optional[datetime] = None,
+                            title: Optional[str] = None):
+        """
+        缓冲对话的更新时间和标题，同一对话的多次更新在写入前合并
+        """
+        with self._condition:
+            if self._stopping:
+                raise RuntimeError("写缓冲已停止")
+            pending = self._conversations.setdefault(conversation_id, {"user_id": user_id})
+            if updated_at is not None:
+                pending["updated_at"] = max(updated_at, pending.get("updated_at", updated_at))
+            if title is not None:
+                pending["title"] = title
+            self._condition.notify()
+
+    # ---- 读取未写入的数据 ----
+
+    def pending_messages(self, conversation_id: int) -> List[PendingMessage]:
+        """
+        对话中尚未写入(或正在写入)的消息，按加入顺序
+        """
+        with self._condition:
+            return [message for message in self._flushing_messages + self._messages
+                    if message.conversation_id == conversation_id]
+
+    def pending_conversation(self, conversation_id: int) -> dict:
+        """
+        对话尚未写入的字段，后加入的覆盖先加入的
+        """
+        with self._condition:
+            merged = dict(self._flushing_conversations.get(conversation_id, {}))
+            merged.update(self._conversations.get(conversation_id, {}))
+        merged.pop("user_id", None)
+        return merged
+
+    def has_pending(self) -> bool:
+        with self._condition:
+            return bool(self._messages or self._conversations or self._flushing_messages
+                        or self._flushing_conversations)
+
+    async def wait_for_conversation(self, conversation_id: int):
+        """
+        立即写入缓冲，并等待该对话已缓冲的消息写入完成
+        """
+        pending = self.pending_messages(conversation_id)
+        if not pending:
+            return
+        with self._condition:
+            self._flush_requested = True
+            self._condition.notify()
+        await asyncio.gather(*(asyncio.wrap_future(message.future) for message in pending),
+                             return_exceptions=True)
+
+    # ---- 后台写入 ----
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """
+        停止后台线程并写完缓冲中的全部数据
+        """
+        with self._condition:
+            self._stopping = True
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        failures = 0
+        while self.has_pending():
+            if self.flush():
+                continue
+            failures += 1
+            if failures > WRITE_BEHIND_STOP_RETRIES:
+                self._fail_pending(RuntimeError("停止时数据库不可用"))
+                break
+            time.sleep(WRITE_BEHIND_RETRY_SECONDS)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                # 没有数据时等待新数据，有数据后最多再等一个间隔以攒成一批
+                while not (self._stopping or self._messages or self._conversations):
+                    self._condition.wait()
+                if not self._stopping and not self._flush_requested:
+                    self._condition.wait_for(lambda: self._stopping or self._flush_requested, self.flush_interval)
+                stopping = self._stopping
+                self._flush_requested = False
+            if stopping:
+                return
+            try:
+                flushed = self.flush()
+            except Exception:
+                # 不让后台线程因意外错误退出，否则之后的消息再也不会写入
+                logger.exception("批量写入出错")
+                flushed = False
+            if not flushed:
+                time.sleep(WRITE_BEHIND_RETRY_SECONDS)
+
+    def flush(self) -> bool:
+        """
+        在一个事务中写入当前缓冲的数据，数据库暂时不可用时放回缓冲并返回False，
+        其他错误时丢弃本批并通知等待方
+        """
+        with self._condition:
+            if self._flushing_messages or self._flushing_conversations:
+                return True  # 另一个线程正在写入
+            messages = self._messages[:self.max_batch]
+            self._messages = self._messages[self.max_batch:]
+            conversations, self._conversations = self._conversations, {}
+            self._flushing_messages = messages
+            self._flushing_conversations = conversations
+        if not messages and not conversations:
+            return True
+
+        try:
+            self._write(messages, conversations)
+        except Exception as e:
+            for message in messages:
+                message.id = None
+            if is_transient_error(e) and self._failed_attempts < WRITE_BEHIND_MAX_RETRIES:
+                self._failed_attempts += 1
+                logger.warning("批量写入失败，稍后重试(第 %d 次): %s", self._failed_attempts, e)
+                with self._condition:
+                    self._messages = messages + self._messages
+                    for conversation_id, fields in conversations.items():
+                        # 重试期间新加入的更新优先
+                        fields.update(self._conversations.get(conversation_id, {}))
+                        self._conversations[conversation_id] = fields
+                    self._flushing_messages = []
+                    self._flushing_conversations = {}
+                return False
+            # 数据本身有问题(如对话已不存在)或多次重试仍失败，丢弃本批并通知等待方
+            self._failed_attempts = 0
+            logger.error("批量写入失败，丢弃 %d 条消息: %s", len(messages), e)
+            for message in messages:
+                message.future.set_exception(e)
+            return True
+        finally:
+            self._finish()
+
+        self._failed_attempts = 0
+        for message in messages:
+            message.future.set_result(message.id)
+        for user_id in {message.user_id for message in messages} | {
+                fields["user_id"] for fields in conversations.values()}:
+            mark_user_write(user_id)
+        self.flushes += 1
+        self.flushed_messages += len(messages)
+        return True
+
+    def _finish(self):
+        with self._condition:
+            self._flushing_messages = []
+            self._flushing_conversations = {}
+
+    def _fail_pending(self, error: Exception):
+        """
+        丢弃缓冲中的全部数据，并通知等待方
+        """
+        with self._condition:
+            messages, self._messages = self._messages, []
+            lost_conversations = len(self._conversations)
+            self._conversations = {}
+        logger.error("%d 条消息和 %d 个对话更新未能写入: %s", len(messages), lost_conversations, error)
+        for message in messages:
+            message.future.set_exception(error)
+
+    def _write(self, messages: List[PendingMessage], conversations: Dict[int, dict]):
+        with engine.begin() as connection:
+            if messages:
+                ids = connection.execute(
+                    insert(Message).returning(Message.id, sort_by_parameter_order=True),
+                    [{"conversation_id": message.conversation_id, "is_user": message.is_user,
+                      "content": message.content, "created_at": message.created_at} for message in messages],
+                ).scalars().all()
+                # 提交前记下ID，读请求据此去掉已在数据库中的消息
+                for message, message_id in zip(messages, ids):
+                    message.id = message_id
+                index_messages(connection, ((message.id, message.conversation_id, message.content)
+                                            for message in messages))
+
+            # 按要更新的字段分组，每组一条多行UPDATE
+            groups: Dict[tuple, list] = {}
+            for conversation_id, fields in conversations.items():
+                values = {key: value for key, value in fields.items() if key != "user_id"}
+                if values:
+                    groups.setdefault(tuple(sorted(values)), []).append({"conversation_id": conversation_id, **values})
+            table = Conversation.__table__
+            for columns, params in groups.items():
+                connection.execute(
+                    update(table).where(table.c.id == bindparam("conversation_id"))
+                    .values({column: bindparam(column) for column in columns}),
+                    params,
+                )
+                if "title" in columns:
+                    for item in params:
+                        index_conversation_title(connection, item["conversation_id"], item["title"], replace=True)
+
+
+def merge_pending(rows: list, pending: List[PendingMessage]) -> list:
+    """
+    合并数据库中的消息与未写入的消息，去掉已写入的部分，按创建时间排序
+    """
+    stored = {row.id for row in rows}
+    merged = list(rows) + [message for message in pending if message.id is None or message.id not in stored]
+    merged.sort(key=lambda item: item.created_at)
+    return merged
+
+
+_write_buffer: Optional[WriteBehindBuffer] = None
+
+
+def get_write_buffer() -> Optional[WriteBehindBuffer]:
+    """
+    获取写缓冲单例，未开启 WRITE_BEHIND_ENABLED 时返回None
+    """
+    global _write_buffer
+    if _write_buffer is None and WRITE_BEHIND_ENABLED:
+        _write_buffer = WriteBehindBuffer()
+        _write_buffer.start()
+    return _write_buffer
+
+
+def stop_write_buffer():
+    """
+    应用停止时写完缓冲
+    """
+    global _write_buffer
+    if _write_buffer is not None:
+        _write_buffer.stop()
+        _write_buffer = None
@@ -0,0 +1 @@
+# 压测工具包
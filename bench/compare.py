@@ -0,0 +1,75 @@
+"""
+比较两次压测结果
+
+    python -m bench.compare base.json head.json --threshold 0.1
+
+当任一接口的p95延迟(或TTFT)比基线慢超过阈值时以非零状态退出，便于在CI中使用。
+"""
+import argparse
+import json
+import sys
+
+METRICS = ["p50", "p95", "p99"]
+
+
+def load(path):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def change(base: float, head: float) -> float:
+    if not base:
+        return 0.0
+    return (head - base) / base
+
+
+def compare(base: dict, head: dict, threshold: float):
+    rows = []
+    regressions = []
+    sections = dict(base.get("operations", {}))
+    sections["ttft"] = base.get("ttft", {})
+    head_sections = dict(head.get("operations", {}))
+    head_sections["ttft"] = head.get("ttft", {})
+
+    for name, base_stats in sections.items():
+        head_stats = head_sections.get(name)
+        if not head_stats or not base_stats.get("count") or not head_stats.get("count"):
+            continue
+        for metric in METRICS:
+            delta = change(base_stats[metric], head_stats[metric])
+            rows.append((name, metric, base_stats[metric], head_stats[metric], delta))
+            if metric == "p95" and delta > threshold:
+                regressions.append(name)
+
+    for key in ("requests_per_second", "events_per_second"):
+        base_value = base.get("throughput", {}).get(key, 0.0)
+        head_value = head.get("throughput", {}).get(key, 0.0)
+        rows.append(("throughput", key, base_value, head_value, change(base_value, head_value)))
+
+    rows.append(("startup", "seconds", base.get("startup_seconds", 0.0), head.get("startup_seconds", 0.0),
+                 change(base.get("startup_seconds", 0.0), head.get("startup_seconds", 0.0))))
+    return rows, regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="比较两次压测结果")
+    parser.add_argument("base")
+    parser.add_argument("head")
+    parser.add_argument("--threshold", type=float, default=0.1, help="p95允许的相对回退比例")
+    args = parser.parse_args(argv)
+
+    base, head = load(args.base), load(args.head)
+    rows, regressions = compare(base, head, args.threshold)
+
+    print(f"base: {base['meta'].get('commit')}  head: {head['meta'].get('commit')}")
+    print(f"{'指标':<22}{'项':<22}{'base':>12}{'head':>12}{'变化':>10}")
+    for name, metric, base_value, head_value, delta in rows:
+        print(f"{name:<22}{metric:<22}{base_value:>12.4f}{head_value:>12.4f}{delta:>+10.1%}")
+
+    if regressions:
+        print(f"p95回退超过 {args.threshold:.0%}: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
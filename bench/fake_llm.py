@@ -0,0 +1,112 @@
+"""
+本地替身LLM服务，模拟TIR/COT/TOT的SSE流式接口
+
+可配置首字延迟(TTFT)、输出速率和故障注入，供压测使用:
+    python -m bench.fake_llm --port 9001 --ttft 0.3 --token-rate 50 --tokens 200
+"""
+import argparse
+import asyncio
+import json
+import random
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+app = FastAPI(title="fake-llm")
+
+# 运行参数，由命令行覆盖
+settings = {
+    "ttft": 0.3,           # 首个事件前的等待秒数
+    "token_rate": 50.0,    # 每秒输出的token数
+    "tokens": 200,         # 每次回答的token数
+    "failure_rate": 0.0,   # 直接返回HTTP 500的概率
+    "drop_rate": 0.0,      # 输出中途断开连接的概率
+    "seed": None,
+}
+
+WORDS = ["设", "函数", "f(x)", "=", "\\int_0^1", "x^2", "dx", "求导", "得", "因此", "答案", "为", "\\frac{1}{3}", "。"]
+
+rng = random.Random()
+
+
+def sse_frame(status: int, answer: str, error: str = "") -> str:
+    """构造与真实模型一致的SSE数据帧"""
+    payload = json.dumps({"status": status, "error": error, "answer": answer}, ensure_ascii=False)
+    return f"data:{payload}\n\n"
+
+
+async def generate_answer(model: str):
+    """按配置的速率逐个输出token"""
+    await asyncio.sleep(settings["ttft"])
+    interval = 1.0 / settings["token_rate"] if settings["token_rate"] > 0 else 0.0
+    tokens = settings["tokens"]
+    drop_at = rng.randint(1, max(tokens - 1, 1)) if rng.random() < settings["drop_rate"] else None
+
+    for i in range(tokens):
+        if drop_at is not None and i == drop_at:
+            raise ConnectionError("注入的中途断开")
+        # TIR在回答中间穿插一段代码及其执行结果
+        if model == "tir" and i == tokens // 2:
+            yield sse_frame(0, "<Python>print(1/3)</Python>")
+            yield sse_frame(1, "0.3333333333333333")
+        yield sse_frame(0, rng.choice(WORDS))
+        if interval:
+            await asyncio.sleep(interval)
+
+
+def stream_or_fail(model: str):
+    if rng.random() < settings["failure_rate"]:
+        return JSONResponse(status_code=500, content={"detail": "注入的故障"})
+    return StreamingResponse(generate_answer(model), media_type="text/event-stream")
+
+
+@app.post("/tir_model")
+async def tir_model(request: Request):
+    await request.body()
+    return stream_or_fail("tir")
+
+
+@app.post("/cot_model")
+async def cot_model(request: Request):
+    await request.body()
+    return stream_or_fail("cot")
+
+
+@app.post("/graph_cot")
+async def tot_model(request: Request):
+    await request.body()
+    return stream_or_fail("tot")
+
+
+@app.get("/health")
+async def health_check():
+    return {"status": "ok"}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="本地替身LLM SSE服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9001)
+    parser.add_argument("--ttft", type=float, default=settings["ttft"])
+    parser.add_argument("--token-rate", type=float, default=settings["token_rate"])
+    parser.add_argument("--tokens", type=int, default=settings["tokens"])
+    parser.add_argument("--failure-rate", type=float, default=settings["failure_rate"])
+    parser.add_argument("--drop-rate", type=float, default=settings["drop_rate"])
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    settings.update(
+        ttft=args.ttft,
+        token_rate=args.token_rate,
+        tokens=args.tokens,
+        failure_rate=args.failure_rate,
+        drop_rate=args.drop_rate,
+        seed=args.seed,
+    )
+    rng.seed(args.seed)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
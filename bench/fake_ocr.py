@@ -0,0 +1,75 @@
+"""
+本地替身腾讯云OCR服务，返回EduPaperOCR格式的响应
+
+应用通过 TENCENT_OCR_URL 指向本服务:
+    python -m bench.fake_ocr --port 9002 --latency 0.2
+"""
+import argparse
+import asyncio
+import random
+import uuid
+
+import uvicorn
+from fastapi import FastAPI, Request
+
+app = FastAPI(title="fake-ocr")
+
+settings = {
+    "latency": 0.2,        # 每次识别的处理耗时(秒)
+    "items": 8,            # 返回的文本块数量
+    "failure_rate": 0.0,   # 返回腾讯云错误响应的概率
+}
+
+rng = random.Random()
+
+
+def edu_paper_infos(count: int):
+    items = []
+    for i in range(count):
+        items.append({
+            "DetectedText": f"{i + 1}. 计算 $\\int_0^{{{i + 1}}} x^2 dx$ 的值",
+            "Itemcoord": {"X": 40, "Y": 60 + i * 80, "Width": 600, "Height": 60},
+        })
+    return items
+
+
+@app.post("/")
+async def edu_paper_ocr(request: Request):
+    await request.body()
+    await asyncio.sleep(settings["latency"])
+    request_id = str(uuid.uuid4())
+    if rng.random() < settings["failure_rate"]:
+        return {"Response": {
+            "Error": {"Code": "FailedOperation.ImageDecodeFailed", "Message": "注入的故障"},
+            "RequestId": request_id,
+        }}
+    return {"Response": {
+        "Angle": 0,
+        "EduPaperInfos": edu_paper_infos(settings["items"]),
+        "QuestionBlockInfos": [],
+        "RequestId": request_id,
+    }}
+
+
+@app.get("/health")
+async def health_check():
+    return {"status": "ok"}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="本地替身腾讯云OCR服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9002)
+    parser.add_argument("--latency", type=float, default=settings["latency"])
+    parser.add_argument("--items", type=int, default=settings["items"])
+    parser.add_argument("--failure-rate", type=float, default=settings["failure_rate"])
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    settings.update(latency=args.latency, items=args.items, failure_rate=args.failure_rate)
+    rng.seed(args.seed)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
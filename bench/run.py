@@ -0,0 +1,393 @@
+"""
+压测与基准测试入口
+
+启动替身LLM/OCR服务和应用本身(默认SQLite，也可指定本地Postgres)，
+模拟N个并发用户依次执行 注册/登录/创建对话/流式提问/保存回答/拉取历史/OCR，
+并将各接口的p50/p95/p99延迟、TTFT和吞吐量输出为JSON，便于在不同提交间比较:
+
+    python -m bench.run --users 50 --turns 3 --output bench_output.json
+    python -m bench.compare base.json bench_output.json
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timezone
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+OPERATIONS = [
+    "register", "login", "create_conversation", "stream_message",
+    "save_response", "get_messages", "list_conversations", "ocr",
+]
+
+
+def free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentile(sorted_values, q: float) -> float:
+    """线性插值的分位数，输入需已排序"""
+    if not sorted_values:
+        return 0.0
+    pos = (len(sorted_values) - 1) * q
+    low = int(pos)
+    high = min(low + 1, len(sorted_values) - 1)
+    return sorted_values[low] + (sorted_values[high] - sorted_values[low]) * (pos - low)
+
+
+def summarize(values):
+    values = sorted(values)
+    if not values:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "mean": round(sum(values) / len(values), 6),
+        "p50": round(percentile(values, 0.50), 6),
+        "p95": round(percentile(values, 0.95), 6),
+        "p99": round(percentile(values, 0.99), 6),
+        "max": round(values[-1], 6),
+    }
+
+
+def git_revision():
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+        dirty = bool(subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"], cwd=ROOT, capture_output=True, text=True
+        ).stdout.strip())
+        return {"commit": commit, "dirty": dirty}
+    except (OSError, subprocess.CalledProcessError):
+        return {"commit": None, "dirty": None}
+
+
+class Recorder:
+    """收集每次请求的耗时与结果"""
+
+    def __init__(self):
+        self.latencies = {op: [] for op in OPERATIONS}
+        self.errors = {op: 0 for op in OPERATIONS}
+        self.ttft = []
+        self.stream_events = 0
+        self.stream_errors = 0
+
+    def record(self, op: str, seconds: float, ok: bool):
+        self.latencies[op].append(seconds)
+        if not ok:
+            self.errors[op] += 1
+
+
+class Process:
+    """以子进程方式运行的服务"""
+
+    def __init__(self, name, args, env=None):
+        self.name = name
+        self.args = args
+        self.env = env
+        self.proc = None
+        self.log = tempfile.TemporaryFile()
+
+    def start(self):
+        self.proc = subprocess.Popen(
+            [sys.executable] + self.args, cwd=ROOT, env=self.env,
+            stdout=self.log, stderr=subprocess.STDOUT,
+        )
+
+    def stop(self):
+        if self.proc and self.proc.poll() is None:
+            self.proc.terminate()
+            try:
+                self.proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.proc.kill()
+
+    def output(self) -> str:
+        self.log.seek(0)
+        return self.log.read().decode("utf-8", "replace")
+
+
+async def wait_healthy(process: Process, url: str, timeout: float) -> float:
+    """轮询健康检查直到服务可用，返回启动耗时"""
+    started = time.perf_counter()
+    async with httpx.AsyncClient() as client:
+        while time.perf_counter() - started < timeout:
+            if process.proc.poll() is not None:
+                raise RuntimeError(f"{process.name} 启动失败:\n{process.output()}")
+            try:
+                response = await client.get(url, timeout=1.0)
+                if response.status_code == 200:
+                    return time.perf_counter() - started
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.05)
+    raise RuntimeError(f"{process.name} 在 {timeout} 秒内未就绪:\n{process.output()}")
+
+
+async def fetch_app_startup(url: str) -> dict:
+    """读取应用自身统计的导入与初始化耗时"""
+    async with httpx.AsyncClient() as client:
+        try:
+            body = (await client.get(url, timeout=5.0)).json()
+        except (httpx.HTTPError, ValueError):
+            return {}
+    return {key: body.get(key) for key in ("import_seconds", "startup_seconds")}
+
+
+async def timed(recorder: Recorder, op: str, coro):
+    started = time.perf_counter()
+    try:
+        response = await coro
+        ok = response.status_code < 400
+    except httpx.HTTPError:
+        response, ok = None, False
+    recorder.record(op, time.perf_counter() - started, ok)
+    return response if ok else None
+
+
+async def stream_message(client, recorder: Recorder, conversation_id: int, query: str, model: str, headers):
+    """发送消息并消费SSE流，记录TTFT与完整耗时，返回拼接后的回答"""
+    started = time.perf_counter()
+    first_event = None
+    answer = []
+    ok = True
+    try:
+        async with client.stream(
+            "POST", f"/api/conversations/{conversation_id}/messages",
+            params={"model": model}, headers=headers,
+            json={"content": query, "conversation_id": conversation_id},
+        ) as response:
+            if response.status_code != 200:
+                ok = False
+            else:
+                async for line in response.aiter_lines():
+                    if not line.startswith("data:"):
+                        continue
+                    payload = line
+                    while payload.startswith("data:"):
+                        payload = payload[5:].lstrip()
+                    # EventSourceResponse会把上游帧包成多行data:，只有能解析出JSON的行才算一个事件
+                    try:
+                        frame = json.loads(payload)
+                    except ValueError:
+                        continue
+                    if first_event is None:
+                        first_event = time.perf_counter() - started
+                    recorder.stream_events += 1
+                    if frame.get("status", 0) < 0:
+                        ok = False
+                    answer.append(frame.get("answer", ""))
+    except httpx.HTTPError:
+        ok = False
+    if first_event is not None:
+        recorder.ttft.append(first_event)
+    if not ok:
+        recorder.stream_errors += 1
+    recorder.record("stream_message", time.perf_counter() - started, ok)
+    return "".join(answer)
+
+
+async def simulate_user(client, recorder: Recorder, args, run_id: str, index: int, image_base64: str):
+    username = f"bench_{run_id}_{index}"
+    password = "bench-password"
+    await timed(recorder, "register", client.post("/api/users/register", json={
+        "username": username, "email": f"{username}@example.com", "password": password,
+    }))
+    response = await timed(recorder, "login", client.post("/api/users/login", data={
+        "username": username, "password": password,
+    }))
+    if response is None:
+        return
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+    response = await timed(recorder, "create_conversation", client.post(
+        "/api/conversations", json={"title": "压测对话"}, headers=headers
+    ))
+    if response is None:
+        return
+    conversation_id = response.json()["id"]
+
+    models = args.models.split(",")
+    for turn in range(args.turns):
+        model = models[(index + turn) % len(models)]
+        query = f"第{turn + 1}题: 求 $\\int_0^1 x^2 dx$ 的值"
+        answer = await stream_message(client, recorder, conversation_id, query, model, headers)
+        await timed(recorder, "save_response", client.post(
+            f"/api/conversations/{conversation_id}/save_response", headers=headers,
+            json={"content": answer or "(空)", "conversation_id": conversation_id, "is_user": False},
+        ))
+        await timed(recorder, "get_messages", client.get(
+            f"/api/conversations/{conversation_id}/messages", headers=headers
+        ))
+
+    await timed(recorder, "list_conversations", client.get("/api/conversations", headers=headers))
+    if args.ocr:
+        response = await timed(recorder, "ocr", client.post(
+            "/api/ocr/recognize", headers=headers, json={"image_base64": image_base64}
+        ))
+        if response is not None and not response.json().get("success"):
+            recorder.errors["ocr"] += 1
+
+
+async def drive(args, base_url: str, recorder: Recorder) -> float:
+    run_id = uuid.uuid4().hex[:8]
+    image_base64 = base64.b64encode(os.urandom(args.image_kb * 1024)).decode("ascii")
+    limits = httpx.Limits(max_connections=args.users, max_keepalive_connections=args.users)
+    timeout = httpx.Timeout(args.request_timeout)
+
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=timeout) as client:
+        async def delayed(index):
+            if args.ramp_up > 0:
+                await asyncio.sleep(args.ramp_up * index / args.users)
+            await simulate_user(client, recorder, args, run_id, index, image_base64)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(delayed(i) for i in range(args.users)))
+        return time.perf_counter() - started
+
+
+def build_report(args, recorder: Recorder, wall_seconds: float, startup_seconds: float, database_url: str):
+    total_requests = sum(len(v) for v in recorder.latencies.values())
+    total_errors = sum(recorder.errors.values())
+    streams = len(recorder.latencies["stream_message"])
+    return {
+        "meta": {
+            **git_revision(),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "database": database_url.split(":", 1)[0],
+        },
+        "config": {
+            "users": args.users,
+            "turns": args.turns,
+            "models": args.models,
+            "ttft": args.ttft,
+            "token_rate": args.token_rate,
+            "tokens": args.tokens,
+            "failure_rate": args.failure_rate,
+            "drop_rate": args.drop_rate,
+            "ocr": args.ocr,
+            "ocr_latency": args.ocr_latency,
+            "image_kb": args.image_kb,
+        },
+        "startup_seconds": round(startup_seconds, 6),
+        "wall_seconds": round(wall_seconds, 6),
+        "operations": {
+            op: {**summarize(values), "errors": recorder.errors[op]}
+            for op, values in recorder.latencies.items() if values
+        },
+        "ttft": summarize(recorder.ttft),
+        "throughput": {
+            "requests_per_second": round(total_requests / wall_seconds, 3) if wall_seconds else 0.0,
+            "streams_per_second": round(streams / wall_seconds, 3) if wall_seconds else 0.0,
+            "events_per_second": round(recorder.stream_events / wall_seconds, 3) if wall_seconds else 0.0,
+        },
+        "totals": {
+            "requests": total_requests,
+            "errors": total_errors,
+            "stream_events": recorder.stream_events,
+            "stream_errors": recorder.stream_errors,
+        },
+    }
+
+
+async def run(args) -> dict:
+    llm_port, ocr_port, app_port = free_port(), free_port(), free_port()
+    workdir = tempfile.mkdtemp(prefix="math-llm-bench-")
+    database_url = args.database_url or f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+
+    fake_llm = Process("fake_llm", [
+        "-m", "bench.fake_llm", "--port", str(llm_port),
+        "--ttft", str(args.ttft), "--token-rate", str(args.token_rate), "--tokens", str(args.tokens),
+        "--failure-rate", str(args.failure_rate), "--drop-rate", str(args.drop_rate),
+    ] + (["--seed", str(args.seed)] if args.seed is not None else []))
+    fake_ocr = Process("fake_ocr", [
+        "-m", "bench.fake_ocr", "--port", str(ocr_port), "--latency", str(args.ocr_latency),
+    ] + (["--seed", str(args.seed)] if args.seed is not None else []))
+
+    llm_base = f"http://127.0.0.1:{llm_port}"
+    env = {
+        **os.environ,
+        "DATABASE_URL": database_url,
+        "SECRET_KEY": os.environ.get("SECRET_KEY", "bench-secret"),
+        "ALGORITHM": os.environ.get("ALGORITHM", "HS256"),
+        "ACCESS_TOKEN_EXPIRE_MINUTES": os.environ.get("ACCESS_TOKEN_EXPIRE_MINUTES", "30"),
+        "TIR_API_URL": f"{llm_base}/tir_model",
+        "COT_API_URL": f"{llm_base}/cot_model",
+        "TOT_API_URL": f"{llm_base}/graph_cot",
+        "TENCENT_SECRET_ID": "bench-secret-id",
+        "TENCENT_SECRET_KEY": "bench-secret-key",
+        "TENCENT_OCR_URL": f"http://127.0.0.1:{ocr_port}/",
+    }
+    app = Process("app", [
+        "-m", "uvicorn", "app.routes:app", "--host", "127.0.0.1", "--port", str(app_port),
+        "--log-level", "warning",
+    ], env=env)
+
+    processes = [fake_llm, fake_ocr, app]
+    try:
+        fake_llm.start()
+        fake_ocr.start()
+        await wait_healthy(fake_llm, f"{llm_base}/health", args.startup_timeout)
+        await wait_healthy(fake_ocr, f"http://127.0.0.1:{ocr_port}/health", args.startup_timeout)
+        app.start()
+        startup_seconds = await wait_healthy(app, f"http://127.0.0.1:{app_port}/health", args.startup_timeout)
+
+        app_startup = await fetch_app_startup(f"http://127.0.0.1:{app_port}/ready")
+
+        recorder = Recorder()
+        wall_seconds = await drive(args, f"http://127.0.0.1:{app_port}", recorder)
+        report = build_report(args, recorder, wall_seconds, startup_seconds, database_url)
+        report["app_startup"] = app_startup
+        return report
+    finally:
+        for process in reversed(processes):
+            process.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="数学问答平台压测工具")
+    parser.add_argument("--users", type=int, default=20, help="并发用户数")
+    parser.add_argument("--turns", type=int, default=3, help="每个用户的提问轮数")
+    parser.add_argument("--models", default="tir,cot,tot", help="轮流使用的模型，逗号分隔")
+    parser.add_argument("--ramp-up", type=float, default=0.0, help="所有用户启动完成所用秒数")
+    parser.add_argument("--database-url", default=None, help="默认使用临时SQLite文件，可指定本地Postgres")
+    parser.add_argument("--ttft", type=float, default=0.3, help="替身LLM首字延迟(秒)")
+    parser.add_argument("--token-rate", type=float, default=50.0, help="替身LLM每秒输出token数")
+    parser.add_argument("--tokens", type=int, default=100, help="替身LLM每次回答的token数")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="替身LLM返回HTTP 500的概率")
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="替身LLM中途断开的概率")
+    parser.add_argument("--no-ocr", dest="ocr", action="store_false", help="跳过OCR请求")
+    parser.add_argument("--ocr-latency", type=float, default=0.2, help="替身OCR处理耗时(秒)")
+    parser.add_argument("--image-kb", type=int, default=256, help="OCR图片大小(KB，编码前)")
+    parser.add_argument("--request-timeout", type=float, default=120.0)
+    parser.add_argument("--startup-timeout", type=float, default=60.0)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--output", default=None, help="结果JSON写入路径，默认输出到标准输出")
+    args = parser.parse_args(argv)
+
+    report = asyncio.run(run(args))
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
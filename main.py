@@ -1,4 +1,102 @@
+import argparse
+import importlib.util
+import os
+
 import uvicorn
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+def env_flag(name: str, default: bool = False) -> bool:
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.lower() in ("1", "true", "yes", "on")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="数学问答平台服务")
+    parser.add_argument("--prod", action="store_true", default=env_flag("PRODUCTION"),
+                        help="生产模式：多进程、无自动重载 (环境变量 PRODUCTION)")
+    parser.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8123")))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WEB_CONCURRENCY", os.cpu_count() or 1)),
+                        help="工作进程数 (环境变量 WEB_CONCURRENCY)")
+    parser.add_argument("--keep-alive", type=int, default=int(os.getenv("KEEP_ALIVE_TIMEOUT", "75")),
+                        help="空闲keep-alive连接保持秒数，应大于前置负载均衡的空闲超时")
+    parser.add_argument("--backlog", type=int, default=int(os.getenv("BACKLOG", "4096")),
+                        help="监听队列长度")
+    parser.add_argument("--drain-timeout", type=float, default=float(os.getenv("SSE_DRAIN_TIMEOUT", "30")),
+                        help="收到SIGTERM后等待进行中的SSE回答结束的秒数")
+    parser.add_argument("--init-db", action="store_true",
+                        help="仅创建数据表后退出，用于部署时的迁移步骤")
+    parser.add_argument("--rebuild-search-index", action="store_true",
+                        help="重建对话历史的全文检索索引后退出")
+    parser.add_argument("--compress-messages", action="store_true",
+                        help="分批压缩已有的长消息后退出")
+    return parser.parse_args(argv)
+
+
+def init_database():
+    from app.database import engine, init_db
+
+    init_db()
+    engine.dispose()
+
+
+def run_production(args):
+    # 安装了uvloop/httptools时使用，否则退回标准实现
+    loop = "uvloop" if importlib.util.find_spec("uvloop") else "asyncio"
+    http = "httptools" if importlib.util.find_spec("httptools") else "h11"
+
+    # 建表只在主进程执行一次，避免多个工作进程并发建表
+    if env_flag("DB_AUTO_CREATE", True):
+        init_database()
+
+    # 已有消息的压缩同样只在主进程的后台线程中执行
+    if env_flag("MESSAGE_COMPRESS_BACKFILL"):
+        from app.compression import start_compression_backfill
+        from app.database import engine
+
+        start_compression_backfill(engine)
+
+    # 工作进程从环境变量读取配置
+    os.environ["SSE_DRAIN_TIMEOUT"] = str(args.drain_timeout)
+    os.environ["DB_AUTO_CREATE"] = "0"
+    os.environ["MESSAGE_COMPRESS_BACKFILL"] = "0"
+
+    uvicorn.run(
+        "app.routes:app",
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        loop=loop,
+        http=http,
+        timeout_keep_alive=args.keep_alive,
+        backlog=args.backlog,
+        # 排空超时后再留几秒给流正常结束，之后强制取消剩余任务
+        timeout_graceful_shutdown=int(args.drain_timeout) + 5,
+        proxy_headers=True,
+        access_log=False,
+    )
+
 
 if __name__ == "__main__":
-    uvicorn.run("app.routes:app", host="0.0.0.0", port=8123, reload=True)
+    args = parse_args()
+    if args.init_db:
+        init_database()
+    elif args.rebuild_search_index:
+        from app.database import engine
+        from app.search import rebuild_search_index
+
+        rebuild_search_index(engine)
+    elif args.compress_messages:
+        from app.compression import compress_existing_messages
+        from app.database import engine
+
+        print(compress_existing_messages(engine))
+    elif args.prod:
+        run_production(args)
+    else:
+        uvicorn.run("app.routes:app", host=args.host, port=args.port, reload=True)
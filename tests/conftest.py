@@ -0,0 +1,37 @@
+import itertools
+import os
+import tempfile
+
+import pytest
+
+# 测试使用临时的SQLite数据库，须在导入 app 之前设置
+os.environ["DATABASE_URL"] = f"sqlite:///{tempfile.mkdtemp()}/test.db"
+os.environ.pop("DATABASE_REPLICA_URL", None)
+
+_usernames = itertools.count()
+
+
+@pytest.fixture
+def user_id():
+    from app.database import SessionLocal, init_db
+    from app.models import User
+
+    init_db()
+    with SessionLocal() as db:
+        name = f"user{next(_usernames)}"
+        user = User(username=name, email=f"{name}@example.com", hashed_password="x")
+        db.add(user)
+        db.commit()
+        return user.id
+
+
+@pytest.fixture
+def conversation_id(user_id):
+    from app.database import SessionLocal
+    from app.models import Conversation
+
+    with SessionLocal() as db:
+        conversation = Conversation(user_id=user_id, title="测试")
+        db.add(conversation)
+        db.commit()
+        return conversation.id
@@ -0,0 +1,95 @@
+import base64
+import os
+
+import pytest
+from sqlalchemy import text
+
+from app import compression
+from app.compression import (COMPRESS_THRESHOLD, RAW_PREFIX, ZLIB_PREFIX, ZSTD_PREFIX, compress_existing_messages,
+                             compress_text, decompress_text)
+from app.database import SessionLocal, engine
+from app.models import Message
+
+LONG_TEXT = "设 $f(x) = \\int_0^x t^2 dt$，求 $f'(x)$。" * 200
+
+
+def stored_content(message_id):
+    # 绕过列类型，读取数据库中的原始文本
+    with engine.connect() as connection:
+        return connection.execute(text("SELECT content FROM messages WHERE id = :id"), {"id": message_id}).scalar()
+
+
+def insert_raw(conversation_id, content):
+    with engine.begin() as connection:
+        connection.execute(text(
+            "INSERT INTO messages (conversation_id, is_user, content, created_at) "
+            "VALUES (:conversation_id, 1, :content, CURRENT_TIMESTAMP)"
+        ), {"conversation_id": conversation_id, "content": content})
+        return connection.execute(text("SELECT max(id) FROM messages")).scalar()
+
+
+def load_content(message_id):
+    with SessionLocal() as db:
+        return db.get(Message, message_id).content
+
+
+def test_short_text_is_stored_as_is():
+    assert compress_text("x" * (COMPRESS_THRESHOLD - 1)) == "x" * (COMPRESS_THRESHOLD - 1)
+
+
+def test_long_text_round_trips_with_zstd():
+    encoded = compress_text(LONG_TEXT)
+    assert encoded.startswith(ZSTD_PREFIX)
+    assert len(encoded) < len(LONG_TEXT.encode("utf-8"))
+    assert decompress_text(encoded) == LONG_TEXT
+
+
+def test_zlib_fallback_without_zstandard(monkeypatch):
+    monkeypatch.setattr(compression, "zstandard", None)
+    encoded = compress_text(LONG_TEXT)
+    assert encoded.startswith(ZLIB_PREFIX)
+    assert decompress_text(encoded) == LONG_TEXT
+
+
+def test_incompressible_text_is_kept():
+    noise = base64.b64encode(os.urandom(COMPRESS_THRESHOLD * 2)).decode("ascii")
+    assert compress_text(noise) == noise
+
+
+@pytest.mark.parametrize("content", ["\x01zs:不是压缩数据", "\x01", "\x01r:" + "x" * 10])
+def test_marker_prefixed_text_is_escaped(content):
+    encoded = compress_text(content)
+    assert encoded == RAW_PREFIX + content
+    assert decompress_text(encoded) == content
+
+
+def test_compressed_text_column_round_trip(conversation_id):
+    with SessionLocal() as db:
+        long_message = Message(conversation_id=conversation_id, is_user=False, content=LONG_TEXT)
+        marked_message = Message(conversation_id=conversation_id, is_user=True, content="\x01zl:用户输入")
+        db.add_all([long_message, marked_message])
+        db.commit()
+        long_id, marked_id = long_message.id, marked_message.id
+
+    assert stored_content(long_id).startswith(ZSTD_PREFIX)
+    assert stored_content(marked_id) == RAW_PREFIX + "\x01zl:用户输入"
+    assert load_content(long_id) == LONG_TEXT
+    assert load_content(marked_id) == "\x01zl:用户输入"
+
+
+def test_existing_plain_rows_are_read_and_backfilled(conversation_id):
+    plain_ids = [insert_raw(conversation_id, LONG_TEXT + str(i)) for i in range(5)]
+    short_id = insert_raw(conversation_id, "短消息")
+    assert load_content(plain_ids[0]) == LONG_TEXT + "0"
+
+    stats = compress_existing_messages(engine, batch_size=2)
+
+    assert stats["compressed"] >= len(plain_ids)
+    assert stats["bytes_after"] < stats["bytes_before"]
+    for i, message_id in enumerate(plain_ids):
+        assert stored_content(message_id).startswith(ZSTD_PREFIX)
+        assert load_content(message_id) == LONG_TEXT + str(i)
+    assert stored_content(short_id) == "短消息"
+
+    # 再次执行时没有需要压缩的消息
+    assert compress_existing_messages(engine, batch_size=2)["compressed"] == 0
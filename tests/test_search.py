@@ -0,0 +1,30 @@
+from app.search import MAX_TOKEN_CHARS, highlight, query_terms, tokenize
+
+
+def test_tokenize_latex():
+    assert tokenize(r"\int_0^1 x^2 \, dx = \frac{1}{3}") == ["int", "0", "1", "x", "2", "dx", "frac", "1", "3"]
+
+
+def test_tokenize_mixed_chinese():
+    assert tokenize("求导 f(x)=Sin x") == ["求", "导", "求导", "f", "x", "sin", "x"]
+    assert query_terms("求导数 sin") == ["求导", "导数", "sin"]
+
+
+def test_tokenize_skips_oversized_tokens():
+    big = str(2 ** 10000)
+    assert len(big) > MAX_TOKEN_CHARS
+    assert tokenize(f"结果 {big} 完毕") == ["结", "果", "结果", "完", "毕", "完毕"]
+    assert tokenize("a" * MAX_TOKEN_CHARS) == ["a" * MAX_TOKEN_CHARS]
+    assert query_terms(big) == []
+
+
+def test_highlight_marks_terms_and_escapes_html():
+    snippet = highlight("设 <b>x</b> 满足 Sin x = 0", ["sin", "满足"])
+    assert snippet == "设 &lt;b&gt;x&lt;/b&gt; <mark>满足</mark> <mark>Sin</mark> x = 0"
+
+
+def test_highlight_trims_long_content():
+    content = "前" * 200 + "积分" + "后" * 200
+    snippet = highlight(content, ["积分"], length=30)
+    assert snippet.startswith("…") and snippet.endswith("…")
+    assert "<mark>积分</mark>" in snippet
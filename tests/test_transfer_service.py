@@ -0,0 +1,100 @@
+import asyncio
+
+import pytest
+
+from app.database import SessionLocal
+from app.models import Conversation, Message, User
+from app.serialization import loads
+from app.transfer_service import ImportFormatError, UserDataImporter, export_user_data, iter_ndjson
+
+LONG_ANSWER = "由洛必达法则，$\\lim_{x\\to 0} \\frac{\\sin x}{x} = 1$。" * 100
+
+
+async def _chunks(data: bytes, size: int):
+    for start in range(0, len(data), size):
+        yield data[start:start + size]
+
+
+def import_ndjson(user_id: int, data: bytes, batch_size: int = 3) -> dict:
+    importer = UserDataImporter(user_id, batch_size=batch_size)
+
+    async def run():
+        async for line_number, record in iter_ndjson(_chunks(data, 7)):
+            importer.add(record, line_number)
+            if importer.full:
+                importer.flush()
+        importer.flush()
+
+    asyncio.run(run())
+    return importer.summary()
+
+
+def conversations_of(user_id: int) -> list:
+    with SessionLocal() as db:
+        conversations = db.query(Conversation).filter(Conversation.user_id == user_id).order_by(Conversation.id).all()
+        return [
+            (conversation.id, conversation.title,
+             [(message.conversation_id, message.is_user, message.content) for message in db.query(Message).filter(
+                 Message.conversation_id == conversation.id).order_by(Message.id)])
+            for conversation in conversations
+        ]
+
+
+@pytest.fixture
+def exported_user(user_id):
+    with SessionLocal() as db:
+        for index in range(3):
+            conversation = Conversation(user_id=user_id, title=f"对话{index}")
+            db.add(conversation)
+            db.flush()
+            db.add_all([
+                Message(conversation_id=conversation.id, is_user=True, content=f"问题{index}"),
+                Message(conversation_id=conversation.id, is_user=False, content=LONG_ANSWER),
+            ])
+        db.add(Conversation(user_id=user_id, title="空对话"))
+        db.commit()
+    return user_id
+
+
+def test_export_import_round_trip(exported_user):
+    with SessionLocal() as db:
+        user = User(username=f"importer{exported_user}", email=f"importer{exported_user}@example.com",
+                    hashed_password="x")
+        db.add(user)
+        db.commit()
+        target = user.id
+
+    data = b"".join(export_user_data(exported_user, "exporter"))
+    records = [loads(line) for line in data.splitlines()]
+    assert records[0]["type"] == "export"
+    assert sum(record["type"] == "message" for record in records) == 6
+
+    summary = import_ndjson(target, data)
+
+    assert summary == {"conversations": 4, "messages": 6, "skipped": 0}
+    source = conversations_of(exported_user)
+    imported = conversations_of(target)
+    assert [title for _, title, _ in imported] == [title for _, title, _ in source]
+    for (new_id, _, new_messages), (old_id, _, old_messages) in zip(imported, source):
+        # 对话获得新ID，消息关联到新对话
+        assert new_id != old_id
+        assert [message[0] for message in new_messages] == [new_id] * len(old_messages)
+        assert [message[1:] for message in new_messages] == [message[1:] for message in old_messages]
+
+
+def test_messages_of_unknown_conversations_are_skipped(user_id):
+    data = (b'{"type": "conversation", "id": 1, "title": "a"}\n'
+            b'{"type": "message", "conversation_id": 1, "is_user": true, "content": "x"}\n'
+            b'{"type": "message", "conversation_id": 2, "is_user": true, "content": "y"}\n')
+
+    assert import_ndjson(user_id, data) == {"conversations": 1, "messages": 1, "skipped": 1}
+
+
+@pytest.mark.parametrize("value", ['"false"', "0", "null"])
+def test_non_boolean_is_user_is_rejected(user_id, value):
+    data = (b'{"type": "conversation", "id": 1, "title": "a"}\n'
+            + f'{{"type": "message", "conversation_id": 1, "is_user": {value}, "content": "x"}}\n'.encode())
+
+    with pytest.raises(ImportFormatError) as error:
+        import_ndjson(user_id, data)
+    assert error.value.line_number == 2
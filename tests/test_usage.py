@@ -0,0 +1,58 @@
+import asyncio
+
+from app import usage
+from app.usage import UsageTracker
+
+
+def test_reload_during_flush_is_not_double_counted(monkeypatch, user_id):
+    tracker = UsageTracker()
+    tracker.record(user_id, "tir", requests=1)
+    assert tracker.used_today(user_id)["requests"] == 1
+
+    write = usage.write_rollups
+
+    def write_then_reload(pending):
+        write(pending)
+        # 写入提交后、合并到缓存前，另一个请求重新加载了合计
+        monkeypatch.setattr(usage, "USAGE_QUOTA_REFRESH_SECONDS", 0)
+        tracker.used_today(user_id)
+        monkeypatch.setattr(usage, "USAGE_QUOTA_REFRESH_SECONDS", 3600)
+
+    monkeypatch.setattr(usage, "write_rollups", write_then_reload)
+    assert tracker.flush()
+
+    assert tracker.used_today(user_id)["requests"] == 1
+
+
+def test_flush_moves_counts_into_cached_totals(user_id):
+    tracker = UsageTracker()
+    tracker.used_today(user_id)
+    tracker.record(user_id, "tir", requests=1, answer_chars=5)
+
+    assert tracker.flush()
+
+    used = tracker.used_today(user_id)
+    assert used["requests"] == 1
+    assert used["answer_chars"] == 5
+
+
+def test_meter_stream_counts_only_parsed_frames(monkeypatch, user_id):
+    tracker = UsageTracker()
+    monkeypatch.setattr(usage, "get_usage_tracker", lambda: tracker)
+
+    async def upstream():
+        for answer in ["一", "二", "三", "四", "五"]:
+            yield 'data:{"status": 0, "answer": "%s"}\n\n' % answer
+        # httpx 的 aiter_text() 最后的空块被包成空帧
+        yield "data:\n\n"
+
+    async def consume():
+        return [chunk async for chunk in usage.meter_stream(upstream(), user_id, "cot")]
+
+    chunks = asyncio.run(consume())
+
+    assert len(chunks) == 6
+    [(model, _, counts)] = tracker.unflushed_for(user_id)
+    assert model == "cot"
+    assert counts["events"] == 5
+    assert counts["answer_chars"] == 5
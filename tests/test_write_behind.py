@@ -0,0 +1,102 @@
+import sqlite3
+
+import pytest
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+
+from app import write_behind
+from app.database import SessionLocal
+from app.models import Message
+from app.write_behind import WriteBehindBuffer
+
+
+@pytest.fixture
+def buffer(monkeypatch):
+    monkeypatch.setattr(write_behind, "WRITE_BEHIND_RETRY_SECONDS", 0.01)
+    buffer = WriteBehindBuffer(flush_ms=1)
+    buffer.start()
+    yield buffer
+    buffer.stop()
+
+
+def fail_first_writes(monkeypatch, buffer, error, times=1):
+    write = buffer._write
+    calls = {"count": 0}
+
+    def flaky_write(messages, conversations):
+        calls["count"] += 1
+        if calls["count"] <= times:
+            raise error
+        write(messages, conversations)
+
+    monkeypatch.setattr(buffer, "_write", flaky_write)
+    return calls
+
+
+def stored_contents(conversation_id):
+    with SessionLocal() as db:
+        return [row.content for row in db.query(Message).filter(
+            Message.conversation_id == conversation_id).order_by(Message.id)]
+
+
+def test_pool_timeout_is_retried(monkeypatch, buffer, conversation_id):
+    calls = fail_first_writes(monkeypatch, buffer, PoolTimeoutError("连接池等待超时"))
+
+    message = buffer.add_message(conversation_id, 1, "第一条", is_user=True)
+
+    assert message.future.result(timeout=5) is not None
+    assert calls["count"] == 2
+    assert stored_contents(conversation_id) == ["第一条"]
+
+
+def test_unexpected_error_fails_batch_and_keeps_writing(monkeypatch, buffer, conversation_id):
+    fail_first_writes(monkeypatch, buffer, RuntimeError("意外错误"))
+
+    failed = buffer.add_message(conversation_id, 1, "丢弃", is_user=True)
+    with pytest.raises(RuntimeError):
+        failed.future.result(timeout=5)
+
+    later = buffer.add_message(conversation_id, 1, "之后的消息", is_user=False)
+    assert later.future.result(timeout=5) is not None
+    assert not buffer.has_pending()
+    assert stored_contents(conversation_id) == ["之后的消息"]
+
+
+def test_non_transient_operational_error_is_not_retried(monkeypatch, buffer, conversation_id):
+    missing_table = OperationalError("INSERT", {}, sqlite3.OperationalError("no such table: search_documents"))
+    calls = fail_first_writes(monkeypatch, buffer, missing_table)
+
+    failed = buffer.add_message(conversation_id, 1, "丢弃", is_user=True)
+    with pytest.raises(OperationalError):
+        failed.future.result(timeout=5)
+    assert calls["count"] == 1
+
+    later = buffer.add_message(conversation_id, 1, "之后的消息", is_user=False)
+    assert later.future.result(timeout=5) is not None
+    assert stored_contents(conversation_id) == ["之后的消息"]
+
+
+def test_transient_errors_give_up_after_max_retries(monkeypatch, buffer, conversation_id):
+    monkeypatch.setattr(write_behind, "WRITE_BEHIND_MAX_RETRIES", 2)
+    locked = OperationalError("INSERT", {}, sqlite3.OperationalError("database is locked"))
+    calls = fail_first_writes(monkeypatch, buffer, locked, times=100)
+
+    message = buffer.add_message(conversation_id, 1, "写不进去", is_user=True)
+    with pytest.raises(OperationalError):
+        message.future.result(timeout=5)
+    assert calls["count"] == 3
+    assert not buffer.has_pending()
+
+
+def test_stop_gives_up_when_database_stays_down(monkeypatch, conversation_id):
+    monkeypatch.setattr(write_behind, "WRITE_BEHIND_RETRY_SECONDS", 0.01)
+    monkeypatch.setattr(write_behind, "WRITE_BEHIND_STOP_RETRIES", 2)
+    buffer = WriteBehindBuffer(flush_ms=1000)
+    fail_first_writes(monkeypatch, buffer, PoolTimeoutError("连接池等待超时"), times=10)
+
+    message = buffer.add_message(conversation_id, 1, "写不进去", is_user=True)
+    buffer.stop()
+
+    assert not buffer.has_pending()
+    with pytest.raises(RuntimeError):
+        message.future.result(timeout=0)